@@ -0,0 +1,134 @@
+"""Measure how many idle Socket.IO connections one server process can hold.
+
+Opens WebSocket clients at a fixed rate, keeps them alive by answering
+Engine.IO pings, and reports every second how many are connected, the
+server's memory and thread count, and the latency of a REST call made
+alongside. Run it against each runtime to compare them:
+
+    python server.py                                   # threading
+    python benchmarks/socket_connections.py --connections 2000 --pid <server pid>
+
+    python serve.py                                    # eventlet
+    ASYNC_MODE=gevent python serve.py                  # gevent
+    python benchmarks/socket_connections.py --connections 10000 --pid <server pid>
+
+Needs the websockets package on the client side. Raise the open file
+limit on both ends (ulimit -n) for large runs.
+"""
+import argparse
+import asyncio
+import resource
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+
+
+async def client(url, stats, stop):
+    import websockets
+    try:
+        async with websockets.connect(url, open_timeout=30, ping_interval=None, max_queue=None) as ws:
+            await ws.recv()  # Engine.IO open packet
+            await ws.send('40')  # connect to the default namespace
+            await ws.recv()
+            stats.connected += 1
+            try:
+                while not stop.is_set():
+                    packet = await ws.recv()
+                    if packet == '2':
+                        await ws.send('3')
+            finally:
+                stats.connected -= 1
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        if stop.is_set():
+            return
+        stats.failed += 1
+
+
+def server_usage(pid):
+    """Return (RSS in MB, thread count) for pid from /proc."""
+    if not pid:
+        return None, None
+    rss = threads = None
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith('Threads:'):
+                    threads = int(line.split()[1])
+    except OSError:
+        pass
+    return rss, threads
+
+
+def probe(base_url):
+    """Return the latency of GET /api/rooms in ms, or None on failure."""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(f'{base_url}/api/rooms', timeout=10) as response:
+            response.read()
+    except OSError:
+        return None
+    return (time.perf_counter() - started) * 1000
+
+
+async def report(args, stats, stop):
+    peak = 0
+    while not stop.is_set():
+        await asyncio.sleep(1)
+        latency = await asyncio.to_thread(probe, args.url)
+        rss, threads = server_usage(args.pid)
+        peak = max(peak, stats.connected)
+        print(f"connected {stats.connected:6}  failed {stats.failed:5}  "
+              f"rss {rss or 0:7.1f} MB  threads {threads or 0:5}  "
+              f"GET /api/rooms {'timeout' if latency is None else f'{latency:.0f} ms'}", flush=True)
+    return peak
+
+
+async def run(args):
+    parts = urlsplit(args.url)
+    scheme = 'wss' if parts.scheme == 'https' else 'ws'
+    ws_url = f'{scheme}://{parts.netloc}/socket.io/?EIO=4&transport=websocket'
+
+    stats = Stats()
+    stop = asyncio.Event()
+    reporter = asyncio.create_task(report(args, stats, stop))
+    clients = []
+    for _ in range(args.connections):
+        clients.append(asyncio.create_task(client(ws_url, stats, stop)))
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.sleep(args.hold)
+    stop.set()
+    peak = await reporter
+    for task in clients:
+        task.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    print(f"peak {peak} concurrent connections, {stats.failed} failed of {args.connections}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=500, help='new connections per second')
+    parser.add_argument('--hold', type=float, default=10, help='seconds to hold all connections open')
+    parser.add_argument('--pid', type=int, help='server process id, for memory and thread counts')
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Compare SQLite write throughput with default settings and the db_config pragmas.
+
+Each writer thread inserts messages one transaction at a time, the way
+post_message commits, against a fresh database file per run:
+
+    python benchmarks/sqlite_write_throughput.py --messages 2000 --threads 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, Text, create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_config import install_sqlite_pragmas  # noqa: E402
+
+metadata = MetaData()
+messages = Table(
+    'messages',
+    metadata,
+    Column('id', String(36), primary_key=True),
+    Column('content', Text),
+    Column('sender_id', String(42)),
+    Column('timestamp', DateTime)
+)
+
+
+def run(tuned, total, threads):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        if tuned:
+            install_sqlite_pragmas(engine)
+        metadata.create_all(engine)
+
+        errors = []
+
+        def writer(count):
+            for i in range(count):
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(messages.insert().values(
+                            id=str(uuid.uuid4()),
+                            content=f"benchmark message {i}",
+                            sender_id='0x' + '0' * 40,
+                            timestamp=datetime.utcnow()
+                        ))
+                except Exception as e:
+                    errors.append(e)
+
+        workers = [threading.Thread(target=writer, args=(total // threads,)) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+
+    written = (total // threads) * threads - len(errors)
+    return written / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    for label, tuned in (('default', False), ('tuned', True)):
+        rate, errors = run(tuned, args.messages, args.threads)
+        print(f"{label:8} {rate:10.0f} messages/s  {errors} failed writes")
+
+
+if __name__ == '__main__':
+    main()
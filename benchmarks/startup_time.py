@@ -0,0 +1,54 @@
+"""Measure how long a server process takes to import and boot polychat.
+
+Each run starts a fresh interpreter against a new SQLite file and times
+`import server` and then create_app(), the two steps a gunicorn worker
+pays before it can take requests:
+
+    python benchmarks/startup_time.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+if hasattr(server, 'create_app'):
+    server.create_app({'START_WORKERS': False})
+booted = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': booted - imported}))
+"""
+
+
+def boot_once():
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(directory, 'startup.db')}")
+        result = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                                capture_output=True, text=True, timeout=300)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    timings = [boot_once() for _ in range(args.runs)]
+    for phase in ('import', 'create_app'):
+        values = [timing[phase] * 1000 for timing in timings]
+        print(f"{phase:10} median {statistics.median(values):8.0f} ms  "
+              f"min {min(values):8.0f} ms  max {max(values):8.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
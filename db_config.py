@@ -0,0 +1,92 @@
+"""Database configuration for polychat.
+
+The database URI and engine pool settings come from the environment, so the
+same code runs against the bundled SQLite file or a PostgreSQL server:
+
+    DATABASE_URL             SQLAlchemy URI (default sqlite:///polychat.db)
+    DB_POOL_SIZE             connections kept open per process
+    DB_MAX_OVERFLOW          extra connections allowed under load
+    DB_POOL_TIMEOUT          seconds to wait for a free connection
+    DB_POOL_RECYCLE          seconds before a connection is replaced
+
+SQLite connections are tuned on connect (WAL journal, busy timeout, relaxed
+fsync, larger page cache and memory-mapped reads). Each pragma can be
+overridden with SQLITE_<PRAGMA>, e.g. SQLITE_SYNCHRONOUS=FULL.
+"""
+import os
+
+from sqlalchemy import event
+
+DEFAULT_DATABASE_URI = 'sqlite:///polychat.db'
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers no longer block the writer
+    'busy_timeout': 5000,  # ms to wait on the write lock instead of "database is locked"
+    'synchronous': 'NORMAL',  # fsync at checkpoints only, safe with WAL
+    'cache_size': -64000,  # negative means KiB, so 64 MB of page cache
+    'mmap_size': 268435456,  # 256 MB of memory-mapped reads
+    'temp_store': 'MEMORY'
+}
+
+POOL_SETTINGS = {
+    'DB_POOL_SIZE': 'pool_size',
+    'DB_MAX_OVERFLOW': 'max_overflow',
+    'DB_POOL_TIMEOUT': 'pool_timeout',
+    'DB_POOL_RECYCLE': 'pool_recycle'
+}
+
+
+def database_uri():
+    uri = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+    # Heroku-style URLs use a scheme SQLAlchemy no longer accepts
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def engine_options(uri):
+    options = {'pool_pre_ping': not uri.startswith('sqlite')}
+    for env_name, option in POOL_SETTINGS.items():
+        if os.environ.get(env_name):
+            options[option] = int(os.environ[env_name])
+    return options
+
+
+def sqlite_pragmas():
+    pragmas = dict(SQLITE_PRAGMAS)
+    for name in pragmas:
+        override = os.environ.get(f'SQLITE_{name.upper()}')
+        if override:
+            pragmas[name] = override
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas=None):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in (pragmas or sqlite_pragmas()).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+def configure_database(app):
+    """Fill in the Flask-SQLAlchemy settings from the environment."""
+    uri = database_uri()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+
+
+def install_sqlite_pragmas(engine):
+    """Apply the SQLite pragmas to every new connection of engine."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas()
+    if engine.url.database in (None, '', ':memory:'):
+        # In-memory databases have no journal file to switch to WAL
+        pragmas.pop('journal_mode')
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, pragmas)
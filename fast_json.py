@@ -0,0 +1,81 @@
+"""JSON encoding for socket frames and message payloads.
+
+Uses orjson when it is installed and falls back to the standard library.
+EncodedJSON wraps a payload that has already been encoded, so the same text
+can go into a room broadcast, an ack and an HTTP response without encoding
+the message again. dumps/loads follow the json module interface, which lets
+this module be passed to SocketIO(json=...).
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def _dumps(obj, default=None):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    _loads = orjson.loads
+else:
+    def _dumps(obj, default=None):
+        return json.dumps(obj, default=default, separators=(',', ':'), ensure_ascii=False)
+
+    _loads = json.loads
+
+
+class EncodedJSON:
+    """An object payload encoded once and spliced verbatim into later output."""
+    __slots__ = ('text',)
+
+    def __init__(self, obj=None, text=None):
+        self.text = text if text is not None else _dumps(obj)
+
+    def merge(self, **fields):
+        """Return a copy with extra top-level keys appended."""
+        if not fields:
+            return self
+        extra = _dumps(fields)[1:-1]
+        if self.text == '{}':
+            return EncodedJSON(text='{' + extra + '}')
+        return EncodedJSON(text=self.text[:-1] + ',' + extra + '}')
+
+    def encode(self):
+        return self.text.encode()
+
+    def __getstate__(self):
+        return self.text
+
+    def __setstate__(self, text):
+        self.text = text
+
+
+def _splice(obj):
+    # Rebuild the envelope around any EncodedJSON values without re-encoding them
+    if isinstance(obj, EncodedJSON):
+        return obj.text
+    if isinstance(obj, dict):
+        return '{' + ','.join(_dumps(str(key)) + ':' + _splice(value) for key, value in obj.items()) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ','.join(_splice(value) for value in obj) + ']'
+    return _dumps(obj)
+
+
+def dumps(obj, **kwargs):
+    """Encode obj to a str, splicing in any EncodedJSON values as-is."""
+    spliced = []
+
+    def default(value):
+        if isinstance(value, EncodedJSON):
+            spliced.append(value)
+            return None
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+    text = _dumps(obj, default=default)
+    return _splice(obj) if spliced else text
+
+
+def loads(s, **kwargs):
+    return _loads(s)
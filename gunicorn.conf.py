@@ -0,0 +1,15 @@
+"""gunicorn settings for polychat, read from the working directory:
+
+    ASYNC_MODE=gevent gunicorn -k gevent serve:app
+
+Run more processes as separate single-worker instances (see serve.py).
+"""
+
+
+def on_starting(server):
+    # Socket.IO long-polling needs every request of a client to reach the
+    # process holding its session, and gunicorn spreads requests over workers
+    if server.cfg.workers > 1:
+        raise SystemExit(f"polychat needs one gunicorn worker per instance, not {server.cfg.workers}; "
+                         f"run several instances on a shared SOCKETIO_MESSAGE_QUEUE behind a "
+                         f"load balancer with sticky sessions (see serve.py)")
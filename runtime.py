@@ -0,0 +1,103 @@
+"""Async runtime selection for polychat.
+
+    ASYNC_MODE            threading (default), eventlet or gevent
+    BLOCKING_POOL_SIZE    native threads for blocking driver calls (default 20)
+
+threading gives every long-poll or WebSocket client its own OS thread,
+which is fine for development. eventlet and gevent serve each client from a
+greenlet, so one process can hold tens of thousands of idle sockets. Those
+runtimes need monkey patching before anything else is imported: start the
+server through serve.py, or call patch() first.
+
+Sockets are cooperative once patched, so Web3's HTTP calls yield to other
+clients. DB drivers such as sqlite3 and psycopg2 block in C and would stall
+every greenlet. install_blocking_pool() therefore wraps each DBAPI
+connection so its calls run in a bounded pool of native threads.
+"""
+import contextvars
+import os
+
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+if ASYNC_MODE not in ASYNC_MODES:
+    raise ValueError(f"ASYNC_MODE must be one of {', '.join(ASYNC_MODES)}, not {ASYNC_MODE!r}")
+
+BLOCKING_POOL_SIZE = int(os.environ.get('BLOCKING_POOL_SIZE', 20))
+
+_patched = False
+
+
+def patch():
+    """Monkey patch the standard library for the selected runtime."""
+    global _patched
+    if _patched:
+        return
+    if ASYNC_MODE == 'eventlet':
+        # tpool reads its size when it starts its threads
+        os.environ.setdefault('EVENTLET_THREADPOOL_SIZE', str(BLOCKING_POOL_SIZE))
+        import eventlet
+        eventlet.monkey_patch()
+    elif ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+        import gevent
+        gevent.get_hub().threadpool.maxsize = BLOCKING_POOL_SIZE
+    _patched = True
+
+
+def run_blocking(fn, *args, **kwargs):
+    """Call fn in the native thread pool and wait for it without blocking other clients."""
+    if ASYNC_MODE == 'threading':
+        return fn(*args, **kwargs)
+    # Carry the caller's context (Flask app and request) into the pool thread
+    context = contextvars.copy_context()
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(context.run, fn, *args, **kwargs)
+    import gevent
+    return gevent.get_hub().threadpool.apply(context.run, (fn,) + args, kwargs)
+
+
+class BlockingProxy:
+    """Forward method calls on a driver object to the native thread pool.
+
+    Results of the methods named in wrap (e.g. connection.cursor) are
+    proxied too, so cursor.execute and the fetch calls run in the pool.
+    Attribute reads and writes pass straight through.
+    """
+    __slots__ = ('_target', '_wrap')
+
+    def __init__(self, target, wrap=()):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_wrap', wrap)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+        if name in self._wrap:
+            def call(*args, **kwargs):
+                return BlockingProxy(run_blocking(value, *args, **kwargs))
+        else:
+            def call(*args, **kwargs):
+                return run_blocking(value, *args, **kwargs)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __iter__(self):
+        return iter(run_blocking(self._target.fetchall))
+
+
+def install_blocking_pool(engine):
+    """Route the engine's DBAPI calls through the native thread pool."""
+    if ASYNC_MODE == 'threading':
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'do_connect')
+    def connect_in_pool(dialect, connection_record, cargs, cparams):
+        connection = run_blocking(dialect.loaded_dbapi.connect, *cargs, **cparams)
+        return BlockingProxy(connection, wrap=('cursor',))
@@ -0,0 +1,40 @@
+"""Production entry point for polychat.
+
+Runs the app on eventlet (or gevent with ASYNC_MODE=gevent), so each idle
+socket costs a greenlet rather than an OS thread. Patching happens before
+the server module is imported:
+
+    python serve.py
+    ASYNC_MODE=gevent PORT=8000 python serve.py
+    ASYNC_MODE=gevent gunicorn -k gevent serve:app
+
+(gunicorn 26 no longer ships an eventlet worker.)
+
+To scale out, run several of these processes (one gunicorn worker each)
+on a shared SOCKETIO_MESSAGE_QUEUE, such as redis:// or amqp://, behind a
+load balancer that keeps each client on one process (e.g. nginx ip_hash).
+Socket.IO long-polling needs that, and so do follow-up calls on a message
+still queued for writing in the process that accepted it. Blocks, presence
+and typing state are shared over the queue (see socket_backend.py).
+gunicorn cannot keep a client on one worker, so gunicorn.conf.py refuses
+more than one.
+"""
+import os
+
+os.environ.setdefault('ASYNC_MODE', 'eventlet')
+
+import runtime  # noqa: E402
+
+runtime.patch()
+
+from server import create_app, socketio  # noqa: E402
+
+app = create_app()
+
+if __name__ == '__main__':
+    options = {}
+    if runtime.ASYNC_MODE == 'eventlet':
+        # eventlet.wsgi stops accepting at 1024 open connections by default
+        options['max_size'] = int(os.environ.get('MAX_CONNECTIONS', 10000))
+    socketio.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 5000)),
+                 **options)
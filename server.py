@@ -1,75 +1,88 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Text, Boolean, ForeignKey, DateTime, Table, func
+from sqlalchemy import Column, Integer, String, Text, Boolean, ForeignKey, DateTime, MetaData, Table, Index, and_, bindparam, case, func, inspect, literal_column, null, or_, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import relationship
+from sqlalchemy.schema import CreateColumn
+import hashlib
+import html
 import json
+import mimetypes
 import os
+import re
+import atexit
 import socket
+import tempfile
 import uuid
 import time
 import threading
+import heapq
+import queue
+from collections import deque, namedtuple
 from datetime import datetime, timedelta
-from werkzeug.utils import secure_filename
+from urllib.parse import urlsplit
 from flask import render_template
+from werkzeug.security import safe_join
+from db_config import configure_database, install_sqlite_pragmas
+from fast_json import EncodedJSON
+from socket_backend import socketio_options, start_listening
+from runtime import ASYNC_MODE, install_blocking_pool
+import fast_json
 
 
-# Try to import Web3, use mock data if not available
-try:
-    from web3 import Web3
-    from web3.middleware import geth_poa_middleware
-    web3_available = True
-except ImportError:
-    web3_available = False
-    print("Web3 not installed. Network status features will be limited.")
-
 app = Flask(__name__, static_folder='static')
 CORS(app)
 
-# SQLAlchemy Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///polychat.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-# SocketIO Configuration
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
+# Extensions are bound to the app in create_app(), so importing this module
+# has no side effects (no database, network or background threads)
+db = SQLAlchemy()
+socketio = SocketIO()
 
 # Environment variables
 INFURA_ID = os.environ.get('INFURA_ID', 'b99b1b2b1ead4bf2bd7b89556e7575f8')
 POLYGON_API_KEY = os.environ.get('POLYGON_API_KEY', 'AVQUKG6XPRQMJSE2A2C283FNECZQZJPSHW')
 
+# Polygon JSON-RPC endpoint for the network sampler. Set POLYGON_RPC_URL to
+# use another endpoint, or to an empty string to run without one.
+DEFAULT_POLYGON_RPC_URL = (
+    f"https://polygon-mainnet.infura.io/v3/{INFURA_ID}" if INFURA_ID else "https://polygon-rpc.com"
+)
+
 # Connect to Polygon Mainnet
-w3 = None
-if web3_available:
+# Called by the network sampler thread; the first RPC it makes is the
+# connection check, so startup never waits on the network.
+def connect_web3(rpc_url):
+    if not rpc_url:
+        return None
     try:
-        if INFURA_ID:
-            polygon_rpc_url = f"https://polygon-mainnet.infura.io/v3/{INFURA_ID}"
-            print("Using Infura endpoint for Polygon")
-        else:
-            polygon_rpc_url = "https://polygon-rpc.com"
-            print("INFURA_ID not set. Using public RPC endpoint for Polygon")
-        
-        w3 = Web3(Web3.HTTPProvider(polygon_rpc_url))
+        from web3 import Web3
+        from web3.middleware import geth_poa_middleware
+    except ImportError:
+        print("Web3 library not available. Using mock network data.")
+        return None
+    
+    try:
+        print(f"Using Polygon RPC endpoint at {urlsplit(rpc_url).hostname}")
+        w3 = Web3(Web3.HTTPProvider(rpc_url))
         # Add PoA middleware for Polygon
         w3.middleware_onion.inject(geth_poa_middleware, layer=0)
-        
-        if w3.is_connected():
-            print("Connected to Polygon: True")
-        else:
-            print("Connected to Polygon: False - Using public RPC endpoint")
+        return w3
     except Exception as e:
         print(f"Error connecting to Polygon: {str(e)}")
-        w3 = None
-else:
-    print("Web3 library not available. Using mock network data.")
+        return None
 
-# Setup upload folder
+# Setup upload folder (created by create_app)
 UPLOAD_FOLDER = os.path.join(app.static_folder, 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Let a front proxy stream uploads: UPLOAD_SENDFILE=x-sendfile (Apache, lighttpd)
+# or x-accel-redirect (nginx, with an internal location at UPLOAD_ACCEL_PREFIX)
+app.config['UPLOAD_SENDFILE'] = os.environ.get('UPLOAD_SENDFILE', '').lower()
+app.config['UPLOAD_ACCEL_PREFIX'] = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_uploads/')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
+app.config['POLYGON_RPC_URL'] = os.environ.get('POLYGON_RPC_URL', DEFAULT_POLYGON_RPC_URL)
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'txt','js','py','html','css','mp3','mp4'}
@@ -94,7 +107,9 @@ friend_requests = Table(
     Column('sender_id', String(42), ForeignKey('users.wallet_address'), primary_key=True),
     Column('receiver_id', String(42), ForeignKey('users.wallet_address'), primary_key=True),
     Column('created_at', DateTime, default=func.now()),
-    Column('status', String(20), default='pending')  # pending, accepted, rejected
+    Column('status', String(20), default='pending'),  # pending, accepted, rejected
+    Index('ix_friend_requests_receiver_status', 'receiver_id', 'status'),
+    Index('ix_friend_requests_sender_status', 'sender_id', 'status')
 )
 
 class User(db.Model):
@@ -104,7 +119,7 @@ class User(db.Model):
     display_name = Column(String(100))
     avatar = Column(String(255))
     bio = Column(Text)
-    last_active = Column(DateTime, default=func.now())
+    last_active = Column(DateTime, default=func.now(), index=True)
     created_at = Column(DateTime, default=func.now())
     
     # Relationships
@@ -147,6 +162,9 @@ class User(db.Model):
 
 class BlockedUser(db.Model):
     __tablename__ = 'blocked_users'
+    __table_args__ = (
+        Index('ix_blocked_users_pair', 'blocker_id', 'blocked_id'),
+    )
     id = Column(Integer, primary_key=True)
     blocker_id = Column(String(42), ForeignKey('users.wallet_address'))
     blocked_id = Column(String(42), ForeignKey('users.wallet_address'))
@@ -189,11 +207,20 @@ class ChatRoom(db.Model):
 
 class PrivateChatRoom(db.Model):
     __tablename__ = 'private_chat_rooms'
+    __table_args__ = (
+        # Pair lookups check both (a, b) and (b, a), and each side uses this index
+        Index('ix_private_chat_rooms_users', 'user1_id', 'user2_id'),
+        Index('ix_private_chat_rooms_user2', 'user2_id'),
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user1_id = Column(String(42), ForeignKey('users.wallet_address'))
     user2_id = Column(String(42), ForeignKey('users.wallet_address'))
     created_at = Column(DateTime, default=func.now())
+    # Inbox summary, maintained on write. last_message_id is not a ForeignKey so
+    # the room <-> message relationships keep a single join path.
+    last_message_id = Column(String(36), nullable=True)
+    last_activity = Column(DateTime, default=func.now())
     
     # Relationships
     user1 = relationship('User', foreign_keys=[user1_id])
@@ -215,6 +242,11 @@ class PrivateChatRoom(db.Model):
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Keyset pagination indexes for room and private room history
+        Index('ix_messages_room_history', 'room_id', 'is_deleted', 'timestamp', 'id'),
+        Index('ix_messages_private_room_history', 'private_room_id', 'is_deleted', 'timestamp', 'id'),
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     content = Column(Text)
@@ -238,9 +270,17 @@ class Message(db.Model):
         self.receiver_id = receiver_id
         self.room_id = room_id
         self.private_room_id = private_room_id
+        self.is_deleted = False
+        # Stamped client-side (UTC, like CURRENT_TIMESTAMP) with microseconds so
+        # (timestamp, id) pagination cursors compare exactly against stored rows
+        self.timestamp = datetime.utcnow()
     
-    def to_dict(self):
-        sender = User.query.get(self.sender_id)
+    def to_dict(self, senders=None):
+        # `senders` is a wallet_address -> User map preloaded by serialize_messages
+        if senders is not None:
+            sender = senders.get(self.sender_id)
+        else:
+            sender = User.query.get(self.sender_id)
         return {
             'id': self.id,
             'content': self.content,
@@ -259,10 +299,522 @@ class Message(db.Model):
             'displayName': sender.display_name if sender else f"User {self.sender_id[:6]}"
         }
 
+class ReadCursor(db.Model):
+    __tablename__ = 'read_cursors'
+    __table_args__ = (
+        # post_message bumps every cursor of a room in one UPDATE
+        Index('ix_read_cursors_room_key', 'room_key'),
+    )
+    
+    user_id = Column(String(42), ForeignKey('users.wallet_address'), primary_key=True)
+    # Same key as the Socket.IO room: room_<id> or private_<id>
+    room_key = Column(String(50), primary_key=True)
+    last_read_message_id = Column(String(36), nullable=True)
+    last_read_at = Column(DateTime, nullable=True)
+    unread_count = Column(Integer, default=0)
+    
+    def __init__(self, user_id, room_key, last_read_message_id=None, last_read_at=None, unread_count=0):
+        self.user_id = user_id
+        self.room_key = room_key
+        self.last_read_message_id = last_read_message_id
+        self.last_read_at = last_read_at
+        self.unread_count = unread_count
+    
+    def to_dict(self):
+        room_type, _, room_id = self.room_key.partition('_')
+        return {
+            'userId': self.user_id,
+            'roomId': room_id if room_type == 'room' else None,
+            'privateRoomId': room_id if room_type == 'private' else None,
+            'lastReadMessageId': self.last_read_message_id,
+            'lastReadAt': self.last_read_at.isoformat() if self.last_read_at else None,
+            'unreadCount': self.unread_count
+        }
+
+def record_unread(room_key, message):
+    """Count a new message as unread for everyone else and as read for its sender."""
+    ReadCursor.query.filter(
+        ReadCursor.room_key == room_key,
+        ReadCursor.user_id != message.sender_id
+    ).update({'unread_count': ReadCursor.unread_count + 1}, synchronize_session=False)
+    ReadCursor.query.filter_by(
+        room_key=room_key, user_id=message.sender_id
+    ).update({
+        'last_read_message_id': message.id,
+        'last_read_at': message.timestamp,
+        'unread_count': 0
+    }, synchronize_session=False)
+
+def forget_unread(room_key, message):
+    """Take a deleted message back out of the unread counts that included it."""
+    ReadCursor.query.filter(
+        ReadCursor.room_key == room_key,
+        ReadCursor.user_id != message.sender_id,
+        ReadCursor.unread_count > 0,
+        or_(ReadCursor.last_read_at == None, ReadCursor.last_read_at < message.timestamp)
+    ).update({'unread_count': ReadCursor.unread_count - 1}, synchronize_session=False)
+
+# Upload storage
+# Uploads are content-addressed: each distinct file is stored once as
+# <sha256>.<ext>, and stored_files counts the references to it. Every
+# upload takes one; an avatar gives its reference back when it is replaced,
+# and a file whose count reaches zero is deleted. Files attached to
+# messages are never released, so they stay.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_URL_PREFIX = '/static/uploads/'
+CONTENT_ADDRESSED_NAME = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_files'
+    
+    name = Column(String(80), primary_key=True)  # <sha256>.<ext>
+    size = Column(Integer)
+    ref_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=func.now())
+    
+    def __init__(self, name, size, ref_count=1):
+        self.name = name
+        self.size = size
+        self.ref_count = ref_count
+
+def stored_upload_name(url):
+    """Return the stored file name behind an upload URL, or None for any other URL."""
+    if not url or not url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    name = url[len(UPLOAD_URL_PREFIX):]
+    return name if CONTENT_ADDRESSED_NAME.match(name) else None
+
+def stored_file_insert():
+    """Return an INSERT into stored_files that supports ON CONFLICT clauses."""
+    insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    return insert(StoredFile.__table__)
+
+def count_upload(name, size):
+    """Add a reference to a stored file, creating its row on the first one.
+    
+    A single upsert, so two workers storing the same file at once cannot
+    both try to insert it."""
+    table = StoredFile.__table__
+    db.session.execute(
+        stored_file_insert()
+        .values(name=name, size=size, ref_count=1)
+        .on_conflict_do_update(index_elements=[table.c.name],
+                               set_={'ref_count': table.c.ref_count + 1})
+    )
+
+def retain_upload(url):
+    """Add a reference to the stored file behind url, if it is one."""
+    name = stored_upload_name(url)
+    if name:
+        StoredFile.query.filter_by(name=name).update(
+            {'ref_count': StoredFile.ref_count + 1}, synchronize_session=False)
+
+def release_upload(url):
+    """Drop a reference to the stored file behind url; delete the file at zero.
+    
+    Call after the change that stopped using url has been committed."""
+    name = stored_upload_name(url)
+    if not name:
+        return
+    StoredFile.query.filter(StoredFile.name == name, StoredFile.ref_count > 0).update(
+        {'ref_count': StoredFile.ref_count - 1}, synchronize_session=False)
+    db.session.commit()
+    if StoredFile.query.filter_by(name=name, ref_count=0).count():
+        delete_unreferenced_upload(name)
+
+def delete_unreferenced_upload(name):
+    """Delete a stored file and its row if nothing references it; commits the session.
+    
+    Also cleans up after a rolled back store_upload, whose file may have no row."""
+    path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+    # Move the file aside before deleting the row. If another upload of the
+    # same content counts it in the meantime, the row survives and the file
+    # is put back; if that upload lands after the row is gone, it writes
+    # a fresh file of its own.
+    aside = f"{path}.{uuid.uuid4().hex}.deleting"
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        aside = None
+    # Inserting the row waits for an upload that has counted the file but
+    # not committed yet, so its reference is seen before the delete
+    db.session.execute(
+        stored_file_insert().values(name=name, ref_count=0).on_conflict_do_nothing(index_elements=['name'])
+    )
+    deleted = StoredFile.query.filter_by(name=name, ref_count=0).delete(synchronize_session=False)
+    db.session.commit()
+    if aside:
+        if deleted:
+            os.remove(aside)
+        else:
+            os.replace(aside, path)
+
+def store_upload(file_storage):
+    """Stream an upload to the upload folder under its SHA-256; return the stored name.
+    
+    The reference is counted in the current transaction, so the caller commits
+    it together with whatever uses the file. If that transaction rolls back,
+    pass the name to delete_unreferenced_upload."""
+    folder = app.config['UPLOAD_FOLDER']
+    extension = file_storage.filename.rsplit('.', 1)[1].lower()
+    digest = hashlib.sha256()
+    size = 0
+    
+    # Hash while writing, so the file is read only once and never held in memory
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.chmod(temp_path, 0o644)
+        
+        name = f"{digest.hexdigest()}.{extension}"
+        # Count the reference before placing the file, so a concurrent
+        # release_upload either waits for the count or loses to the fresh file
+        count_upload(name, size)
+        # Same name means same content, so a rename over it is harmless
+        os.replace(temp_path, os.path.join(folder, name))
+        return name
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def serialize_messages(messages, known_users=None):
+    """Serialize a list of messages, loading all of their senders in one query.
+    
+    Users already at hand can be passed as known_users to skip loading them."""
+    senders = {user.wallet_address: user for user in (known_users or [])}
+    sender_ids = {msg.sender_id for msg in messages if msg.sender_id and msg.sender_id not in senders}
+    if sender_ids:
+        senders.update({
+            user.wallet_address: user
+            for user in User.query.filter(User.wallet_address.in_(sender_ids)).all()
+        })
+    return [msg.to_dict(senders=senders) for msg in messages]
+
+def refresh_private_room_summary(private_room_id):
+    """Point a private room's inbox summary at its newest visible message."""
+    last_message = Message.query.filter_by(
+        private_room_id=private_room_id, is_deleted=False
+    ).order_by(Message.timestamp.desc(), Message.id.desc()).first()
+    PrivateChatRoom.query.filter_by(id=private_room_id).update({
+        'last_message_id': last_message.id if last_message else None,
+        'last_activity': last_message.timestamp if last_message else PrivateChatRoom.created_at
+    }, synchronize_session=False)
+
+def add_missing_columns():
+    """Add model columns that are missing from existing tables; return them as (table, column)."""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.Model.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                    added.append((table.name, column.name))
+    return added
+
+def encode_cursor(message):
+    """Build a (timestamp, id) pagination cursor for a message."""
+    return f"{message.timestamp.isoformat()}_{message.id}"
+
+def decode_cursor(cursor):
+    """Parse a cursor built by encode_cursor, returning (timestamp, id) or None."""
+    try:
+        timestamp, message_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except (AttributeError, ValueError):
+        return None
+
+# In-process room registry
+# Socket events resolve rooms by name or id several times a second, so public
+# rooms are cached here instead of being looked up in the database each time.
+CachedRoom = namedtuple('CachedRoom', ['id', 'name', 'description', 'is_private'])
+
+class RoomRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name = {}
+        self._by_id = {}
+        # Private rooms are never renamed or deleted, so only their ids are kept
+        self._private_ids = set()
+    
+    def add(self, room):
+        cached = CachedRoom(room.id, room.name, room.description, room.is_private)
+        with self._lock:
+            self._by_id[cached.id] = cached
+            if cached.name:
+                self._by_name[cached.name] = cached
+        return cached
+    
+    def clear(self):
+        with self._lock:
+            self._by_name.clear()
+            self._by_id.clear()
+            self._private_ids.clear()
+    
+    def resolve(self, name_or_id):
+        """Find a chat room by name, falling back to its id."""
+        if not name_or_id:
+            return None
+        with self._lock:
+            cached = self._by_name.get(name_or_id) or self._by_id.get(name_or_id)
+        if cached:
+            return cached
+        
+        room = ChatRoom.query.filter_by(name=name_or_id).first()
+        if not room:
+            room = ChatRoom.query.get(name_or_id)
+        return self.add(room) if room else None
+    
+    def resolve_private(self, room_id):
+        """Return room_id if it names an existing private chat room."""
+        if not room_id:
+            return None
+        with self._lock:
+            if room_id in self._private_ids:
+                return room_id
+        
+        if not PrivateChatRoom.query.get(room_id):
+            return None
+        with self._lock:
+            self._private_ids.add(room_id)
+        return room_id
+
+room_registry = RoomRegistry()
+
+# Shared state
+# Blocks, presence and typing are kept in memory. When several server
+# processes share a message queue, each change is also sent to the others
+# with share_state() and applied to their copies (see socket_backend.py).
+# Frames built from that state (typing_users, user_disconnected,
+# network_status) are then emitted by every process to its own clients only.
+def share_state(name, change):
+    """Send a state change to the other server processes; the caller applies it here."""
+    socketio.server.manager.share(name, change)
+
+def emit_locally(event, data, **kwargs):
+    """Emit to the clients of this process only."""
+    socketio.emit(event, data, ignore_queue=True, **kwargs)
+
+# Message delivery filtering
+# Blocks are held in memory as blocked user -> blockers. Every session of a
+# wallet joins its user room, and skip_sid accepts rooms, so a message
+# fan-out can skip the sessions of everyone who blocked the sender in
+# whichever process they are connected to.
+class BlockRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocked_by = {}  # blocked wallet -> set of blocker wallets
+    
+    def load(self):
+        blocked_by = {}
+        for blocker_id, blocked_id in db.session.query(BlockedUser.blocker_id, BlockedUser.blocked_id).all():
+            blocked_by.setdefault(blocked_id, set()).add(blocker_id)
+        with self._lock:
+            self._blocked_by = blocked_by
+    
+    def block(self, blocker_id, blocked_id):
+        with self._lock:
+            self._blocked_by.setdefault(blocked_id, set()).add(blocker_id)
+    
+    def unblock(self, blocker_id, blocked_id):
+        with self._lock:
+            blockers = self._blocked_by.get(blocked_id)
+            if blockers:
+                blockers.discard(blocker_id)
+                if not blockers:
+                    del self._blocked_by[blocked_id]
+    
+    def apply(self, change):
+        """Apply a block or unblock shared by another server process."""
+        if change['blocked']:
+            self.block(change['blockerId'], change['blockedId'])
+        else:
+            self.unblock(change['blockerId'], change['blockedId'])
+    
+    def blockers_of(self, wallet_address):
+        with self._lock:
+            return set(self._blocked_by.get(wallet_address, ()))
+
+block_registry = BlockRegistry()
+
+def blocked_recipient_rooms(sender_id):
+    """User rooms whose sessions must not receive messages from sender_id (for skip_sid)."""
+    return [f"user_{blocker_id}" for blocker_id in block_registry.blockers_of(sender_id)]
+
+# User search index
+# On SQLite an FTS5 table mirrors users.display_name plus the lowercase hex of
+# wallet_address (without 0x) for prefix search. Rows are keyed by an
+# UNINDEXED wallet_address rather than by rowid, because VACUUM may renumber
+# the implicit rowids of users. Triggers keep it in sync on user create,
+# rename and delete (renames and deletes scan the index, but are rare);
+# other databases fall back to LIKE scans.
+USER_SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE users_fts USING fts5(
+        wallet_address UNINDEXED, wallet_hex, display_name, tokenize = 'unicode61', prefix = '3 4'
+    )""",
+    """CREATE TRIGGER users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(wallet_address, wallet_hex, display_name)
+        VALUES (new.wallet_address, {wallet_hex}, new.display_name);
+    END""",
+    """CREATE TRIGGER users_fts_update AFTER UPDATE OF wallet_address, display_name ON users BEGIN
+        DELETE FROM users_fts WHERE wallet_address = old.wallet_address;
+        INSERT INTO users_fts(wallet_address, wallet_hex, display_name)
+        VALUES (new.wallet_address, {wallet_hex}, new.display_name);
+    END""",
+    """CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN
+        DELETE FROM users_fts WHERE wallet_address = old.wallet_address;
+    END""",
+    """INSERT INTO users_fts(wallet_address, wallet_hex, display_name)
+        SELECT wallet_address, {wallet_hex_of_users}, display_name FROM users"""
+]
+
+def wallet_hex_sql(column):
+    return f"lower(CASE WHEN lower(substr({column}, 1, 2)) = '0x' THEN substr({column}, 3) ELSE {column} END)"
+
+def setup_search_index(table_name, statements):
+    """Create an FTS5 index and its backfill if missing; return whether it is usable."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with db.engine.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+            ).first()
+            if not exists:
+                for statement in statements:
+                    conn.exec_driver_sql(statement)
+                print(f"Search index {table_name} created")
+        return True
+    except Exception as e:
+        # SQLite builds without FTS5
+        print(f"Search index {table_name} unavailable: {str(e)}")
+        return False
+
+def build_user_match(query):
+    """Turn free text into an FTS5 prefix query over names and wallet hex."""
+    terms = [term for term in re.split(r'[^\w]+', query.lower()) if term]
+    if not terms:
+        return None
+    name_match = 'display_name : (' + ' '.join(f'"{term}"*' for term in terms) + ')'
+    hex_query = query.strip().lower()
+    if hex_query.startswith('0x'):
+        hex_query = hex_query[2:]
+    if hex_query and re.fullmatch(r'[0-9a-f]+', hex_query):
+        return f'wallet_hex : "{hex_query}"* OR {name_match}'
+    return name_match
+
+# Message search index
+# messages_fts holds the id and content of every visible message. It is keyed
+# by the message id rather than by rowid, because VACUUM may renumber the
+# implicit rowids of messages. Unlike the users index it is maintained by
+# post_message and delete_message, and holds no deleted rows.
+MESSAGE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE messages_fts USING fts5(id UNINDEXED, content, tokenize = 'unicode61')",
+    """INSERT INTO messages_fts(id, content)
+        SELECT id, content FROM messages WHERE is_deleted = 0 AND content IS NOT NULL"""
+]
+# Created by setup_search_index, so it is kept out of db.Model.metadata
+messages_fts = Table(
+    'messages_fts',
+    MetaData(),
+    Column('id', String(36)),
+    Column('content', Text)
+)
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'  # replaced by <mark> after escaping
+
+def index_message(message):
+    """Add a message to the search index in the current transaction."""
+    if not app.config.get('MESSAGE_SEARCH_FTS') or message.content is None:
+        return
+    db.session.execute(messages_fts.insert().values(id=message.id, content=message.content))
+
+def unindex_message(message):
+    """Remove a message from the search index in the current transaction."""
+    if not app.config.get('MESSAGE_SEARCH_FTS') or message.content is None:
+        return
+    # FTS5 cannot look rows up by an UNINDEXED column, so narrow the delete
+    # with a phrase match on the message's own text and scan only as a fallback
+    phrase = '"' + message.content.replace('"', '""') + '"'
+    matching = select(literal_column('rowid')).select_from(messages_fts).where(
+        messages_fts.c.content.op('MATCH')(phrase), messages_fts.c.id == message.id
+    ).scalar_subquery()
+    deleted = db.session.execute(
+        messages_fts.delete().where(literal_column('rowid').in_(matching))
+    ).rowcount
+    if not deleted:
+        db.session.execute(messages_fts.delete().where(messages_fts.c.id == message.id))
+
+def build_message_match(query):
+    """Turn free text into an FTS5 query matching every term, the last one as a prefix."""
+    terms = [term for term in re.split(r'[^\w]+', query.lower()) if term]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+def like_pattern(query):
+    """Wrap free text for a LIKE substring match, escaping its own wildcards (use escape='\\')."""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def highlight_snippet(snippet):
+    return html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+# SQLite data migrations
+# Each entry runs once per database file, in order; PRAGMA user_version holds
+# the number of entries applied, so a normal start only reads the pragma.
+SQLITE_MIGRATIONS = [
+    # SQLite compares timestamps as text. Older rows were stored by func.now()
+    # without microseconds, so pad them to the format cursors are bound in.
+    ["UPDATE messages SET timestamp = timestamp || '.000000' WHERE length(timestamp) = 19"],
+    # messages_fts was keyed by rowid; setup_search_index rebuilds it keyed by id
+    ["DROP TABLE IF EXISTS messages_fts"],
+    # Likewise users_fts and its triggers, rebuilt keyed by wallet_address
+    [
+        "DROP TRIGGER IF EXISTS users_fts_insert",
+        "DROP TRIGGER IF EXISTS users_fts_update",
+        "DROP TRIGGER IF EXISTS users_fts_delete",
+        "DROP TABLE IF EXISTS users_fts"
+    ],
+]
+
+def run_sqlite_migrations():
+    """Apply the SQLite migrations the database has not seen yet."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        applied = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for number, statements in enumerate(SQLITE_MIGRATIONS[applied:], start=applied + 1):
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+            print(f"Database migration {number} applied")
+
 # Create database and default rooms
 def create_tables():
     with app.app_context():
         db.create_all()
+        added_columns = add_missing_columns()
+        
+        # create_all skips indexes on tables that already exist
+        for table in db.Model.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        
+        run_sqlite_migrations()
         
         # Add default rooms if they don't exist
         if ChatRoom.query.count() == 0:
@@ -274,9 +826,24 @@ def create_tables():
             db.session.add_all(default_rooms)
             db.session.commit()
             print("Default chat rooms created")
-
-# Initialize the database when the app starts
-create_tables()
+        
+        # Backfill inbox summaries when upgrading an existing database
+        if ('private_chat_rooms', 'last_message_id') in added_columns:
+            for (room_id,) in db.session.query(PrivateChatRoom.id).all():
+                refresh_private_room_summary(room_id)
+            db.session.commit()
+            print("Private chat inbox summaries backfilled")
+        
+        app.config['USER_SEARCH_FTS'] = setup_search_index('users_fts', [
+            statement.format(
+                wallet_hex=wallet_hex_sql('new.wallet_address'),
+                wallet_hex_of_users=wallet_hex_sql('wallet_address')
+            )
+            for statement in USER_SEARCH_DDL
+        ])
+        app.config['MESSAGE_SEARCH_FTS'] = setup_search_index('messages_fts', MESSAGE_SEARCH_DDL)
+        room_registry.clear()
+        block_registry.load()
 
 @app.route('/api/users/block', methods=['POST'])
 def block_user():
@@ -291,6 +858,8 @@ def block_user():
     new_block = BlockedUser(blocker_id=blocker_id, blocked_id=blocked_id)
     db.session.add(new_block)
     db.session.commit()
+    block_registry.block(blocker_id, blocked_id)
+    share_state('blocks', {'blockerId': blocker_id, 'blockedId': blocked_id, 'blocked': True})
     return jsonify(new_block.to_dict()), 200
 
 @app.route('/api/users/unblock', methods=['POST'])
@@ -304,32 +873,636 @@ def unblock_user():
     if block_entry:
         db.session.delete(block_entry)
         db.session.commit()
+        block_registry.unblock(blocker_id, blocked_id)
+        share_state('blocks', {'blockerId': blocker_id, 'blockedId': blocked_id, 'blocked': False})
         return jsonify({"message": "User unblocked successfully"}), 200
     return jsonify({"error": "Block entry not found"}), 404
 
+# Typing indicators
+# Typing events are coalesced per room and broadcast as a single periodic
+# "who is typing" frame instead of one frame per keystroke burst.
+TYPING_FLUSH_INTERVAL = 1.0  # seconds between typing_users frames
+TYPING_THROTTLE = 1.0  # repeated "still typing" events inside this window are dropped
+TYPING_TIMEOUT = 6.0  # typists who never send isTyping=false expire after this
+
+class TypingAggregator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._typing = {}  # socket room -> {user_id: last accepted event time}
+        self._dirty = set()
+        self._names = {}  # user_id -> display name
+    
+    def set_display_name(self, user_id, display_name):
+        with self._lock:
+            self._names[user_id] = display_name
+    
+    def display_name(self, user_id):
+        with self._lock:
+            name = self._names.get(user_id)
+        if name is None:
+            user = User.query.get(user_id)
+            name = user.display_name if user else f"User {user_id[:6]}"
+            self.set_display_name(user_id, name)
+        return name
+    
+    def update(self, room_name, user_id, is_typing, throttle=True):
+        """Record a typing event; return whether it was accepted."""
+        now = time.time()
+        with self._lock:
+            typists = self._typing.setdefault(room_name, {})
+            last_seen = typists.get(user_id)
+            if is_typing:
+                if throttle and last_seen is not None and now - last_seen < TYPING_THROTTLE:
+                    return False
+                typists[user_id] = now
+                if last_seen is None:
+                    self._dirty.add(room_name)
+            elif last_seen is not None:
+                del typists[user_id]
+                self._dirty.add(room_name)
+            else:
+                return False
+        return True
+    
+    def apply(self, change):
+        """Apply a typing event accepted by another server process."""
+        self.set_display_name(change['userId'], change['displayName'])
+        # Already throttled where it was accepted
+        self.update(change['room'], change['userId'], change['isTyping'], throttle=False)
+    
+    def collect(self):
+        """Expire stale typists and return the typing users of every changed room."""
+        now = time.time()
+        with self._lock:
+            for room_name, typists in self._typing.items():
+                expired = [user_id for user_id, seen in typists.items() if now - seen > TYPING_TIMEOUT]
+                for user_id in expired:
+                    del typists[user_id]
+                if expired:
+                    self._dirty.add(room_name)
+            
+            changed = {
+                room_name: [
+                    {'userId': user_id, 'displayName': self._names.get(user_id, f"User {user_id[:6]}")}
+                    for user_id in self._typing.get(room_name, {})
+                ]
+                for room_name in self._dirty
+            }
+            self._dirty.clear()
+            for room_name in [name for name, typists in self._typing.items() if not typists]:
+                del self._typing[room_name]
+        return changed
+
+typing_aggregator = TypingAggregator()
+
+def flush_typing_indicators():
+    while True:
+        try:
+            for room_name, users in typing_aggregator.collect().items():
+                emit_locally('typing_users', {'users': users}, room=room_name)
+        except Exception as e:
+            print(f"Error in typing thread: {str(e)}")
+        time.sleep(TYPING_FLUSH_INTERVAL)
+
+# Network status sampling
+# One background sampler keeps a snapshot of the chain head, so the cost of
+# /api/network-status no longer depends on RPC latency or on how many clients poll.
+NETWORK_SAMPLE_INTERVAL = 2  # seconds between chain samples, about one Polygon block
+NETWORK_STATUS_ROOM = 'network_status'  # socket room that receives a frame per new block
+NETWORK_MAX_BACKOFF = 60  # longest wait between samples while the RPC endpoint is unreachable
+
+MOCK_NETWORK_STATUS = {
+    "connected": True,
+    "latestBlock": 12345678,
+    "gasPrice": "50000000000",
+    "chainId": 137,
+    "blockTimestamp": None,
+    "blockTransactions": 100,
+    "blockHash": "0x1234567890abcdef1234567890abcdef1234567890abcdef1234567890abcdef"
+}
+
+class NetworkSampler:
+    def __init__(self, web3_client=None):
+        self.w3 = web3_client
+        self._lock = threading.Lock()
+        self._chain_id = None  # never changes for an endpoint, so fetched once
+        self._snapshot = None
+        self._sampled_at = None
+        self._last_block = None
+        self._delay = NETWORK_SAMPLE_INTERVAL
+    
+    def sample(self):
+        """Refresh the snapshot with two RPCs: the latest block and the gas price."""
+        if self.w3 is None:
+            return None
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        
+        # The latest block carries its own number, so eth_blockNumber is not needed
+        block = self.w3.eth.get_block('latest')
+        gas_price = self.w3.eth.gas_price
+        snapshot = {
+            "connected": True,
+            "latestBlock": block['number'],
+            "gasPrice": str(gas_price),
+            "chainId": self._chain_id,
+            "blockTimestamp": block['timestamp'],
+            "blockTransactions": len(block['transactions']),
+            "blockHash": self.w3.to_hex(block['hash'])
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self._sampled_at = time.time()
+        return snapshot
+    
+    def step(self):
+        """Sample once; return (seconds until the next sample, snapshot to broadcast or None).
+        
+        While the endpoint fails, the last values are served flagged as
+        disconnected and the delay doubles up to NETWORK_MAX_BACKOFF. The
+        outage and the recovery are each logged and broadcast once."""
+        try:
+            snapshot = self.sample()
+        except Exception as e:
+            outage_started = self._delay == NETWORK_SAMPLE_INTERVAL
+            if outage_started:
+                print(f"Error getting blockchain data, retrying with backoff: {str(e)}")
+                with self._lock:
+                    self._snapshot = dict(self._snapshot or {}, connected=False)
+            self._delay = min(self._delay * 2, NETWORK_MAX_BACKOFF)
+            return self._delay, self.current() if outage_started else None
+        
+        recovered = self._delay != NETWORK_SAMPLE_INTERVAL
+        if recovered:
+            print("Blockchain data available again")
+            self._delay = NETWORK_SAMPLE_INTERVAL
+        if snapshot is None or (snapshot['latestBlock'] == self._last_block and not recovered):
+            return self._delay, None
+        self._last_block = snapshot['latestBlock']
+        return self._delay, self.current()
+    
+    def current(self):
+        with self._lock:
+            if self._snapshot is None:
+                return None
+            age = round(time.time() - self._sampled_at, 1) if self._sampled_at else None
+            return dict(self._snapshot, age=age)
+
+network_sampler = NetworkSampler()
+
+def sample_network_status():
+    network_sampler.w3 = connect_web3(app.config['POLYGON_RPC_URL'])
+    if network_sampler.w3 is None:
+        return
+    while True:
+        delay, update = network_sampler.step()
+        if update:
+            try:
+                # Every server process samples the chain for its own clients
+                emit_locally('network_status', update, room=NETWORK_STATUS_ROOM)
+            except Exception as e:
+                print(f"Error in network thread: {str(e)}")
+        time.sleep(delay)
+
+# Presence tracking
+# Heartbeats only touch memory; last_active is written back to the users table
+# in one batched UPDATE per interval instead of one commit per request. The
+# same batch goes to the other server processes, as do remembered profiles,
+# so each of them serves and expires the same set of active users.
+ACTIVE_USER_WINDOW = timedelta(minutes=5)
+PRESENCE_FLUSH_INTERVAL = 10  # seconds between last_active write-backs
+PRESENCE_SWEEP_INTERVAL = 5  # seconds between inactivity expiry checks
+PRESENCE_CHANGE_LOG_SIZE = 1000  # changes kept for ?since= delta polling
+
+class PresenceTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_active = {}  # wallet_address -> datetime
+        self._profiles = {}  # wallet_address -> User.to_dict() snapshot
+        self._pending = {}  # wallet_address -> last_active not yet written
+        # Expiry heap of (deadline, wallet_address) with one entry per online
+        # user; deadlines are re-checked lazily when an entry reaches the top.
+        self._expiry = []
+        self._online = set()
+        # Joins, leaves and profile changes bump the version; heartbeats do not.
+        # The epoch keeps version tokens from one process run from matching another.
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+        self._changes = deque(maxlen=PRESENCE_CHANGE_LOG_SIZE)  # (version, wallet_address)
+        self._snapshot = None  # (token, users, encoded users) for the current version
+    
+    def knows(self, wallet_address):
+        with self._lock:
+            return wallet_address in self._profiles
+    
+    def display_name(self, wallet_address):
+        with self._lock:
+            profile = self._profiles.get(wallet_address)
+        return profile['displayName'] if profile else None
+    
+    def remember(self, user):
+        """Store the profile fields served by get_active_users; return them for share_state."""
+        profile = user.to_dict()
+        profile.pop('lastActive', None)
+        last_active = self._store(profile, user.last_active or datetime.now())
+        return {'profile': profile, 'lastActive': last_active.isoformat()}
+    
+    def apply(self, change):
+        """Store a profile remembered by another server process."""
+        self._store(change['profile'], datetime.fromisoformat(change['lastActive']))
+    
+    def _store(self, profile, last_active):
+        wallet_address = profile['walletAddress']
+        with self._lock:
+            changed = self._profiles.get(wallet_address) != profile
+            self._profiles[wallet_address] = profile
+            self._last_active[wallet_address] = max(self._last_active.get(wallet_address, last_active), last_active)
+            self._schedule(wallet_address)
+            if changed:
+                self._record(wallet_address)
+            return self._last_active[wallet_address]
+    
+    def touch(self, wallet_address):
+        with self._lock:
+            now = datetime.now()
+            self._last_active[wallet_address] = now
+            self._pending[wallet_address] = now
+            self._schedule(wallet_address)
+    
+    def apply_heartbeats(self, heartbeats):
+        """Apply the last_active values flushed by another server process.
+        
+        Returns the wallets without a profile here, which are skipped."""
+        unknown = []
+        with self._lock:
+            for wallet_address, seen in heartbeats.items():
+                if wallet_address not in self._profiles:
+                    unknown.append(wallet_address)
+                    continue
+                seen = datetime.fromisoformat(seen)
+                if seen > self._last_active[wallet_address]:
+                    self._last_active[wallet_address] = seen
+                self._schedule(wallet_address)
+        return unknown
+    
+    def _schedule(self, wallet_address):
+        # Caller holds the lock
+        if wallet_address not in self._online:
+            self._online.add(wallet_address)
+            deadline = self._last_active[wallet_address] + ACTIVE_USER_WINDOW
+            heapq.heappush(self._expiry, (deadline, wallet_address))
+            self._record(wallet_address)
+    
+    def _record(self, wallet_address):
+        # Caller holds the lock
+        self._version += 1
+        self._changes.append((self._version, wallet_address))
+        self._snapshot = None
+    
+    def _token(self):
+        return f"{self._epoch}.{self._version}"
+    
+    def _profile(self, wallet_address):
+        # Caller holds the lock
+        return dict(self._profiles[wallet_address], lastActive=self._last_active[wallet_address].isoformat())
+    
+    def expire(self):
+        """Return users that crossed the inactivity threshold, once per transition."""
+        now = datetime.now()
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, wallet_address = heapq.heappop(self._expiry)
+                deadline = self._last_active[wallet_address] + ACTIVE_USER_WINDOW
+                if deadline > now:
+                    # Touched since this entry was scheduled
+                    heapq.heappush(self._expiry, (deadline, wallet_address))
+                    continue
+                self._online.discard(wallet_address)
+                del self._last_active[wallet_address]
+                self._profiles.pop(wallet_address, None)
+                self._record(wallet_address)
+                expired.append(wallet_address)
+        return expired
+    
+    def snapshot(self):
+        """Return (version token, active users map, the map encoded as JSON).
+        
+        The map is built once per version, so lastActive values are as of the
+        latest join, leave or profile change."""
+        with self._lock:
+            if self._snapshot is None:
+                users = {
+                    wallet_address: self._profile(wallet_address)
+                    for wallet_address in self._online
+                    if wallet_address in self._profiles
+                }
+                self._snapshot = (self._token(), users, json.dumps(users))
+            return self._snapshot
+    
+    def changes_since(self, token):
+        """Return (version token, joined or updated users, left users) after token.
+        
+        Returns None when the token is from another process or process run, or
+        older than the change log, and the caller has to fall back to a full
+        snapshot."""
+        with self._lock:
+            epoch, _, version = (token or '').partition('.')
+            if epoch != self._epoch or not version.isdigit() or int(version) > self._version:
+                return None
+            version = int(version)
+            if version < self._version and (not self._changes or self._changes[0][0] > version + 1):
+                return None
+            
+            changed = {wallet_address for change_version, wallet_address in self._changes if change_version > version}
+            users = {}
+            left = []
+            for wallet_address in changed:
+                if wallet_address in self._online and wallet_address in self._profiles:
+                    users[wallet_address] = self._profile(wallet_address)
+                else:
+                    left.append(wallet_address)
+            return self._token(), users, left
+    
+    def load(self):
+        """Seed the tracker with users the database already considers active."""
+        cutoff = datetime.now() - ACTIVE_USER_WINDOW
+        for user in User.query.filter(User.last_active > cutoff).all():
+            self.remember(user)
+    
+    def flush(self):
+        """Write pending last_active values with a single executemany UPDATE.
+        
+        Returns them as {wallet_address: ISO timestamp}, for share_state."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        rows = [{'wallet': wallet_address, 'seen': seen} for wallet_address, seen in pending.items()]
+        
+        if rows:
+            users = User.__table__
+            stmt = users.update().where(
+                users.c.wallet_address == bindparam('wallet')
+            ).values(last_active=bindparam('seen'))
+            db.session.execute(stmt, rows)
+            db.session.commit()
+        return {wallet_address: seen.isoformat() for wallet_address, seen in pending.items()}
+
+presence_tracker = PresenceTracker()
+
+def remember_user(user):
+    """Remember a profile for presence and typing, here and in the other server processes."""
+    typing_aggregator.set_display_name(user.wallet_address, user.display_name)
+    share_state('profiles', presence_tracker.remember(user))
+
+def apply_shared_profile(change):
+    profile = change['profile']
+    typing_aggregator.set_display_name(profile['walletAddress'], profile['displayName'])
+    presence_tracker.apply(change)
+
+def apply_shared_heartbeats(heartbeats):
+    unknown = presence_tracker.apply_heartbeats(heartbeats)
+    if unknown:
+        # Remembered by another process before this one started listening
+        with app.app_context():
+            for user in User.query.filter(User.wallet_address.in_(unknown)).all():
+                presence_tracker.remember(user)
+        presence_tracker.apply_heartbeats(heartbeats)
+
+def flush_presence():
+    with app.app_context():
+        try:
+            presence_tracker.load()
+        except Exception as e:
+            print(f"Error loading presence: {str(e)}")
+    while True:
+        time.sleep(PRESENCE_FLUSH_INTERVAL)
+        try:
+            with app.app_context():
+                heartbeats = presence_tracker.flush()
+            if heartbeats:
+                share_state('heartbeats', heartbeats)
+        except Exception as e:
+            print(f"Error in presence thread: {str(e)}")
+
+def flush_presence_on_exit():
+    with app.app_context():
+        presence_tracker.flush()
+
 # Clean up inactive users
 def cleanup_inactive_users():
     while True:
         try:
-            with app.app_context():
-                current_time = datetime.now()
-                five_minutes_ago = current_time - timedelta(minutes=5)
-                
-                # Fixed query to avoid using timestamp() method
-                inactive_users = User.query.filter(
-                    User.last_active < five_minutes_ago
-                ).all()
-                
-                for user in inactive_users:
-                    print(f"Marking user as inactive: {user.wallet_address}")
-                    socketio.emit('user_disconnected', {'userId': user.wallet_address})
+            for wallet_address in presence_tracker.expire():
+                print(f"Marking user as inactive: {wallet_address}")
+                # Every server process expires its own copy for its own clients
+                emit_locally('user_disconnected', {'userId': wallet_address})
         except Exception as e:
             print(f"Error in cleanup thread: {str(e)}")
-        time.sleep(60)
+        time.sleep(PRESENCE_SWEEP_INTERVAL)
 
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_inactive_users, daemon=True)
-cleanup_thread.start()
+# Message ingestion
+# post_message answers right away and hands the message to a single writer
+# thread, which persists everything queued within a few milliseconds in one
+# transaction, so a burst of messages shares one commit and one fsync. The
+# room broadcast runs on the writer thread after the commit, so other clients
+# only see messages that exist. The sender gets its copy before that; endpoints
+# that look one up by id call message_ingestor.wait_for() on a miss.
+INGEST_BATCH_SIZE = 500  # most messages per group commit
+INGEST_MAX_DELAY = 0.005  # seconds a batch waits for more messages
+INGEST_ACK_TIMEOUT = 5  # seconds a durable post waits for its commit
+
+class IngestTicket:
+    def __init__(self, announce=None):
+        self._event = threading.Event()
+        self.error = None
+        # Called on the writer thread with the commit's error, or None once saved
+        self.announce = announce
+    
+    @property
+    def persisted(self):
+        return self._event.is_set() and self.error is None
+    
+    def finish(self, error=None):
+        self.error = error
+        self._event.set()
+    
+    def wait(self, timeout=None):
+        """Wait for the message's commit; return whether it was persisted."""
+        self._event.wait(timeout)
+        return self.persisted
+
+class MessageIngestor:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = {}  # message id -> ticket, until its commit finishes
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """Persist everything still queued, then stop the writer thread."""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+    
+    def submit(self, message, room_key, announce=None):
+        """Queue a new message, with its id and timestamp already set, for writing.
+        
+        announce(error) runs on the writer thread once the write finishes,
+        with error None when the message was committed."""
+        ticket = IngestTicket(announce)
+        with self._lock:
+            self._pending[message.id] = ticket
+        self._queue.put((message, room_key, ticket))
+        return ticket
+    
+    def wait_for(self, message_id, timeout=None):
+        """Wait until a queued message is written; return False if it is not queued or failed."""
+        with self._lock:
+            ticket = self._pending.get(message_id)
+        return ticket.wait(timeout) if ticket else False
+    
+    def _next_batch(self):
+        # Returns (batch, stopping)
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + INGEST_MAX_DELAY
+        while len(batch) < INGEST_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+    
+    def _write(self, batch):
+        messages = Message.__table__
+        db.session.execute(messages.insert(), [
+            {column.name: getattr(message, column.key) for column in messages.columns}
+            for message, _, _ in batch
+        ])
+        for message, room_key, _ in batch:
+            if message.private_room_id:
+                # Keep the inbox summary current in the same transaction
+                PrivateChatRoom.query.filter_by(id=message.private_room_id).update({
+                    'last_message_id': message.id,
+                    'last_activity': message.timestamp
+                }, synchronize_session=False)
+            record_unread(room_key, message)
+            index_message(message)
+        db.session.commit()
+    
+    def _persist(self, batch):
+        with app.app_context():
+            try:
+                self._write(batch)
+            except Exception as e:
+                db.session.rollback()
+                if len(batch) > 1:
+                    # Retry one by one so a single bad message cannot sink the batch
+                    for item in batch:
+                        self._persist([item])
+                    return
+                print(f"Error persisting message {batch[0][0].id}: {str(e)}")
+                self._finish(batch, e)
+                return
+        self._finish(batch)
+    
+    def _finish(self, batch, error=None):
+        with self._lock:
+            for message, _, _ in batch:
+                self._pending.pop(message.id, None)
+        for message, _, ticket in batch:
+            if ticket.announce:
+                try:
+                    ticket.announce(error)
+                except Exception as e:
+                    print(f"Error announcing message {message.id}: {str(e)}")
+            ticket.finish(error)
+    
+    def _run(self):
+        while True:
+            try:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._persist(batch)
+                if stopping:
+                    return
+            except Exception as e:
+                print(f"Error in ingestion thread: {str(e)}")
+
+message_ingestor = MessageIngestor()
+
+# Application setup
+# Everything with side effects happens here rather than at import time.
+def subscribe_shared_state():
+    """Apply the state changes other server processes send with share_state."""
+    manager = socketio.server.manager
+    manager.on_state('blocks', block_registry.apply)
+    manager.on_state('profiles', apply_shared_profile)
+    manager.on_state('heartbeats', apply_shared_heartbeats)
+    manager.on_state('typing', typing_aggregator.apply)
+
+def start_workers():
+    """Start the background threads and register their exit hooks."""
+    targets = [flush_typing_indicators, flush_presence, cleanup_inactive_users]
+    if app.config.get('POLYGON_RPC_URL'):
+        targets.append(sample_network_status)
+    for target in targets:
+        threading.Thread(target=target, daemon=True).start()
+    atexit.register(flush_presence_on_exit)
+    
+    # Start ingestion thread, and drain it before the process exits
+    message_ingestor.start()
+    atexit.register(message_ingestor.stop)
+
+def create_app(config=None):
+    """Configure the app, create tables and start the background workers.
+    
+    config overrides app.config, e.g. {'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db'};
+    pass START_WORKERS=False for scripts and tests that only need the database.
+    The app is set up once per process: later calls without config return it,
+    and later calls with config raise RuntimeError rather than ignore it.
+    """
+    if app.extensions.get('sqlalchemy'):
+        if config:
+            raise RuntimeError("create_app() already ran in this process; pass config to the first call")
+        return app
+    
+    # SQLAlchemy Configuration (see db_config.py for the environment variables)
+    configure_database(app)
+    app.config.update(config or {})
+    app.config['USE_X_SENDFILE'] = app.config['UPLOAD_SENDFILE'] == 'x-sendfile'
+    db.init_app(app)
+    with app.app_context():
+        install_blocking_pool(db.engine)
+        install_sqlite_pragmas(db.engine)
+    
+    # SocketIO Configuration (frames are encoded by fast_json, with orjson when installed)
+    # ASYNC_MODE selects threading, eventlet or gevent (see runtime.py and serve.py)
+    # SOCKETIO_MESSAGE_QUEUE joins several server processes (see socket_backend.py and serve.py)
+    socketio.init_app(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, json=fast_json,
+                      **socketio_options())
+    subscribe_shared_state()
+    
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    if app.config.get('START_WORKERS', True):
+        # Before create_tables loads the block list that shared changes keep current
+        start_listening(socketio.server)
+    create_tables()
+    if app.config.get('START_WORKERS', True):
+        start_workers()
+    return app
 
 # --------------------- REST API Endpoints ---------------------
 
@@ -343,36 +1516,187 @@ def index():
 def serve_static(path):
     return send_from_directory('static', path)
 
+# Serve uploads. Content-addressed files (<sha256>.<ext>) never change, so
+# they get their hash as a strong ETag and a year of immutable caching.
+# Range requests are answered with 206 by send_from_directory, or by the
+# front proxy when UPLOAD_SENDFILE is set.
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+
+@app.route('/static/uploads/<path:filename>')
+def serve_upload(filename):
+    match = CONTENT_ADDRESSED_NAME.match(filename)
+    content_hash = match.group(1) if match else None
+    mode = app.config['UPLOAD_SENDFILE']
+    
+    if mode == 'x-accel-redirect':
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({"error": "File not found"}), 404
+        # nginx streams the file from its internal location
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = app.config['UPLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + filename
+    else:
+        # With UPLOAD_SENDFILE=x-sendfile, send_file emits X-Sendfile instead of the body
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                       etag=content_hash or True, conditional=not mode)
+    
+    if content_hash:
+        response.set_etag(content_hash)
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = UPLOAD_MAX_AGE
+        response.cache_control.immutable = True
+    if mode:
+        # The proxy answers Range requests itself; only If-None-Match is handled here
+        response = response.make_conditional(request)
+    return response
+
 # Get messages (filtered by room or private chat)
+# Pages are keyset-paginated on (timestamp, id): pass `before` to scroll back
+# through history or `after` to catch up on newer messages.
 @app.route('/api/messages', methods=['GET'])
 def get_messages():
     room_id = request.args.get('room')
     private_room_id = request.args.get('privateRoom')
-    limit = int(request.args.get('limit', 50))
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    before = request.args.get('before')
+    after = request.args.get('after')
     
     if private_room_id:
-        messages = Message.query.filter_by(
+        query = Message.query.filter_by(
             private_room_id=private_room_id, 
             is_deleted=False
-        ).order_by(Message.timestamp.desc()).limit(limit).all()
+        )
     elif room_id:
-        # Find room by name first
-        room = ChatRoom.query.filter_by(name=room_id).first()
+        # Find room by name or ID
+        room = room_registry.resolve(room_id)
         if room:
-            messages = Message.query.filter_by(
+            query = Message.query.filter_by(
                 room_id=room.id, 
                 is_deleted=False
-            ).order_by(Message.timestamp.desc()).limit(limit).all()
+            )
         else:
             # Try to find by ID
-            messages = Message.query.filter_by(
+            query = Message.query.filter_by(
                 room_id=room_id, 
                 is_deleted=False
-            ).order_by(Message.timestamp.desc()).limit(limit).all()
+            )
     else:
         return jsonify({"error": "Room ID or Private Room ID required"}), 400
     
-    return jsonify([msg.to_dict() for msg in reversed(messages)])
+    if before and after:
+        return jsonify({"error": "Use either before or after, not both"}), 400
+    
+    cursor = decode_cursor(before or after) if (before or after) else None
+    if (before or after) and not cursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    
+    key = tuple_(Message.timestamp, Message.id)
+    if after:
+        # Oldest first, starting right after the cursor
+        messages = query.filter(key > cursor).order_by(
+            Message.timestamp.asc(), Message.id.asc()
+        ).limit(limit).all()
+    else:
+        if before:
+            query = query.filter(key < cursor)
+        messages = query.order_by(
+            Message.timestamp.desc(), Message.id.desc()
+        ).limit(limit).all()
+        messages.reverse()
+    
+    next_cursor = None
+    if len(messages) == limit:
+        next_cursor = encode_cursor(messages[-1] if after else messages[0])
+    
+    return jsonify({
+        "messages": serialize_messages(messages),
+        "nextCursor": next_cursor
+    })
+
+# Create a message; shared by the REST endpoint and the send_message socket event
+def send_chat_message(data):
+    """Validate, queue and broadcast a new message; return (body, status)."""
+    if 'content' not in data or 'walletAddress' not in data:
+        return {"error": "Invalid message format - missing content or walletAddress"}, 400
+    
+    # Check if user exists or create new user
+    sender = User.query.get(data['walletAddress'])
+    created = sender is None
+    if not sender:
+        sender = User(
+            wallet_address=data['walletAddress'],
+            display_name=data.get('sender', f"User {data['walletAddress'][:6]}")
+        )
+        db.session.add(sender)
+    
+    # Update user's last activity
+    presence_tracker.touch(data['walletAddress'])
+    
+    # Create message
+    message = Message(
+        content=data['content'],
+        sender_id=data['walletAddress'],
+        type=data.get('type', 'text'),
+        file_url=data.get('fileUrl'),
+        file_name=data.get('fileName')
+    )
+    
+    # Set room or private chat
+    new_room = None
+    if 'privateRoomId' in data:
+        message.private_room_id = data['privateRoomId']
+        room_for_socket = f"private_{data['privateRoomId']}"
+    elif 'room' in data:
+        # Find room by name or ID
+        room = room_registry.resolve(data['room'])
+        if room:
+            message.room_id = room.id
+            room_for_socket = f"room_{room.id}"
+        else:
+            # Create a new room if it doesn't exist
+            new_room = ChatRoom(data['room'], f"Chat room {data['room']}")
+            db.session.add(new_room)
+            created = True
+            message.room_id = new_room.id
+            room_for_socket = f"room_{new_room.id}"
+    else:
+        return {"error": "Room or Private Room ID required"}, 400
+    
+    # New senders and rooms are rare; commit them now so the batched
+    # message insert can rely on them (and does not wait on our write lock)
+    if created:
+        db.session.commit()
+    if new_room is not None:
+        room_registry.add(new_room)
+    if not presence_tracker.knows(sender.wallet_address):
+        remember_user(sender)
+    
+    # Encode once; the same text goes to the room broadcast, the ack and the response
+    payload = EncodedJSON(serialize_messages([message], known_users=[sender])[0])
+    
+    def announce(error):
+        if error is None:
+            # Send message via WebSocket, skipping users who blocked the sender
+            socketio.emit('new_message', payload, room=room_for_socket,
+                          skip_sid=blocked_recipient_rooms(message.sender_id))
+        else:
+            # The sender already shows the message; tell it to take it back
+            socketio.emit('message_failed', {
+                'messageId': message.id,
+                'error': str(error)
+            }, room=f"user_{message.sender_id}")
+    
+    # Persist in the next group commit, which broadcasts the message once it is saved
+    ticket = message_ingestor.submit(message, room_for_socket, announce)
+    
+    # Clients that need durability pass durable=true to wait for the commit
+    if data.get('durable'):
+        if not ticket.wait(INGEST_ACK_TIMEOUT):
+            error = str(ticket.error) if ticket.error else "Timed out waiting for the message to be saved"
+            return {"error": error, "id": message.id}, 500
+    
+    return payload.merge(persisted=ticket.persisted), 201
 
 # Post new message
 @app.route('/api/messages', methods=['POST'])
@@ -383,68 +1707,169 @@ def post_message():
         
         if not data:
             return jsonify({"error": "No data provided"}), 400
-        if 'content' not in data or 'walletAddress' not in data:
-            return jsonify({"error": "Invalid message format - missing content or walletAddress"}), 400
-        
-        # Check if user exists or create new user
-        sender = User.query.get(data['walletAddress'])
-        if not sender:
-            sender = User(
-                wallet_address=data['walletAddress'],
-                display_name=data.get('sender', f"User {data['walletAddress'][:6]}")
+        if request.args.get('durable') == 'true':
+            data = dict(data, durable=True)
+        
+        body, status = send_chat_message(data)
+        if isinstance(body, EncodedJSON):
+            return Response(body.text, status, mimetype='application/json')
+        return jsonify(body), status
+    except Exception as e:
+        print(f"Error in post_message: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+# Search message content in public rooms and the caller's private chats
+# Results are newest first; pass nextCursor back as `before` for the next page.
+@app.route('/api/messages/search', methods=['GET'])
+def search_messages():
+    wallet_address = request.args.get('walletAddress')
+    query = request.args.get('query', '')
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    before = request.args.get('before')
+    
+    if not wallet_address:
+        return jsonify({"error": "Wallet address required"}), 400
+    if len(query.strip()) < 2:
+        return jsonify({"error": "Search query must be at least 2 characters"}), 400
+    
+    cursor = decode_cursor(before) if before else None
+    if before and not cursor:
+        return jsonify({"error": "Invalid cursor"}), 400
+    
+    try:
+        # Only public rooms and private rooms the caller takes part in
+        conditions = [
+            Message.is_deleted == False,
+            or_(
+                Message.room_id.in_(select(ChatRoom.id).where(ChatRoom.is_private == False)),
+                Message.private_room_id.in_(select(PrivateChatRoom.id).where(or_(
+                    PrivateChatRoom.user1_id == wallet_address, PrivateChatRoom.user2_id == wallet_address
+                )))
             )
-            db.session.add(sender)
-        
-        # Update user's last activity
-        sender.last_active = datetime.now()
-        
-        # Create message
-        message = Message(
-            content=data['content'],
-            sender_id=data['walletAddress'],
-            type=data.get('type', 'text'),
-            file_url=data.get('fileUrl'),
-            file_name=data.get('fileName')
-        )
+        ]
+        if request.args.get('privateRoom'):
+            conditions.append(Message.private_room_id == request.args.get('privateRoom'))
+        elif request.args.get('room'):
+            room = room_registry.resolve(request.args.get('room'))
+            conditions.append(Message.room_id == (room.id if room else request.args.get('room')))
+        if cursor:
+            # Same (timestamp, id) keyset as GET /api/messages
+            conditions.append(tuple_(Message.timestamp, Message.id) < cursor)
         
-        # Set room or private chat
-        if 'privateRoomId' in data:
-            message.private_room_id = data['privateRoomId']
-            room_for_socket = f"private_{data['privateRoomId']}"
-        elif 'room' in data:
-            # Find room by name
-            room = ChatRoom.query.filter_by(name=data['room']).first()
-            if room:
-                message.room_id = room.id
-                room_for_socket = f"room_{room.id}"
-            else:
-                # Try to find by ID
-                room = ChatRoom.query.get(data['room'])
-                if room:
-                    message.room_id = room.id
-                    room_for_socket = f"room_{room.id}"
-                else:
-                    # Create a new room if it doesn't exist
-                    new_room = ChatRoom(data['room'], f"Chat room {data['room']}")
-                    db.session.add(new_room)
-                    db.session.flush()  # Get the ID without committing
-                    message.room_id = new_room.id
-                    room_for_socket = f"room_{new_room.id}"
+        match = build_message_match(query) if app.config.get('MESSAGE_SEARCH_FTS') else None
+        if match:
+            conditions.append(literal_column('messages_fts').op('MATCH')(match))
+            stmt = select(
+                Message.id,
+                func.snippet(literal_column('messages_fts'), 1, SNIPPET_START, SNIPPET_END, '…', 12)
+            ).select_from(messages_fts).join(Message, Message.id == messages_fts.c.id)
+        else:
+            conditions.append(Message.content.like(like_pattern(query), escape='\\'))
+            stmt = select(Message.id, null())
+        stmt = stmt.where(*conditions).order_by(
+            Message.timestamp.desc(), Message.id.desc()
+        ).limit(limit)
+        
+        snippets = dict(db.session.execute(stmt).all())
+        messages = Message.query.filter(Message.id.in_(list(snippets))).order_by(
+            Message.timestamp.desc(), Message.id.desc()
+        ).all() if snippets else []
+        
+        results = serialize_messages(messages)
+        for result in results:
+            snippet = snippets[result['id']]
+            result['snippet'] = highlight_snippet(snippet) if snippet is not None else html.escape(result['content'] or '')
+        
+        next_cursor = None
+        if len(messages) == limit:
+            next_cursor = encode_cursor(messages[-1])
+        
+        return jsonify({
+            "messages": results,
+            "nextCursor": next_cursor
+        })
+    except Exception as e:
+        print(f"Error in search_messages: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+# Mark a room or private chat as read up to a message (the newest one by default)
+@app.route('/api/read-cursors', methods=['POST'])
+def mark_read():
+    try:
+        data = request.json
+        wallet_address = data.get('walletAddress')
+        
+        if not wallet_address:
+            return jsonify({"error": "Wallet address required"}), 400
+        
+        if data.get('privateRoomId'):
+            private_room_id = room_registry.resolve_private(data['privateRoomId'])
+            if not private_room_id:
+                return jsonify({"error": "Private room not found"}), 404
+            room_key = f"private_{private_room_id}"
+            query = Message.query.filter_by(private_room_id=private_room_id, is_deleted=False)
+        elif data.get('room'):
+            room = room_registry.resolve(data['room'])
+            if not room:
+                return jsonify({"error": "Room not found"}), 404
+            room_key = f"room_{room.id}"
+            query = Message.query.filter_by(room_id=room.id, is_deleted=False)
         else:
             return jsonify({"error": "Room or Private Room ID required"}), 400
         
-        db.session.add(message)
-        db.session.commit()
+        if data.get('messageId'):
+            last_read = query.filter_by(id=data['messageId']).first()
+            if not last_read:
+                # It may still be waiting for its group commit
+                message_ingestor.wait_for(data['messageId'], INGEST_ACK_TIMEOUT)
+                last_read = query.filter_by(id=data['messageId']).first()
+            if not last_read:
+                return jsonify({"error": "Message not found"}), 404
+        else:
+            last_read = query.order_by(Message.timestamp.desc(), Message.id.desc()).first()
         
-        # Send message via WebSocket
-        socketio.emit('new_message', message.to_dict(), room=room_for_socket)
+        unread_count = 0
+        if last_read:
+            # Newer messages than the read one, excluding the reader's own
+            unread_count = query.filter(
+                tuple_(Message.timestamp, Message.id) > (last_read.timestamp, last_read.id),
+                Message.sender_id != wallet_address
+            ).count()
         
-        return jsonify(message.to_dict()), 201
+        cursor = ReadCursor.query.get((wallet_address, room_key))
+        if not cursor:
+            cursor = ReadCursor(wallet_address, room_key)
+            db.session.add(cursor)
+        cursor.last_read_message_id = last_read.id if last_read else None
+        cursor.last_read_at = last_read.timestamp if last_read else datetime.utcnow()
+        cursor.unread_count = unread_count
+        db.session.commit()
+        
+        return jsonify(cursor.to_dict()), 200
     except Exception as e:
-        print(f"Error in post_message: {str(e)}")
+        print(f"Error in mark_read: {str(e)}")
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+# Get unread counts for all of a user's rooms and private chats
+@app.route('/api/unread', methods=['GET'])
+def get_unread_counts():
+    wallet_address = request.args.get('walletAddress')
+    
+    if not wallet_address:
+        return jsonify({"error": "Wallet address required"}), 400
+    
+    result = {"rooms": {}, "privateRooms": {}}
+    for cursor in ReadCursor.query.filter_by(user_id=wallet_address).all():
+        cursor_data = cursor.to_dict()
+        if cursor_data['privateRoomId']:
+            result["privateRooms"][cursor_data['privateRoomId']] = cursor.unread_count
+        else:
+            result["rooms"][cursor_data['roomId']] = cursor.unread_count
+    
+    return jsonify(result)
+
 # Delete message
 @app.route('/api/messages/<message_id>', methods=['DELETE'])
 def delete_message(message_id):
@@ -456,19 +1881,28 @@ def delete_message(message_id):
             return jsonify({"error": "Wallet address required"}), 400
         
         message = Message.query.get(message_id)
+        if not message:
+            # It may have been broadcast but still be waiting for its group commit
+            message_ingestor.wait_for(message_id, INGEST_ACK_TIMEOUT)
+            message = Message.query.get(message_id)
         if not message:
             return jsonify({"error": "Message not found"}), 404
         
         if message.sender_id != wallet_address:
             return jsonify({"error": "You can only delete your own messages"}), 403
         
+        # Repeat deletes must not adjust unread counts or the search index again
+        if message.is_deleted:
+            return jsonify({"success": True, "messageId": message_id}), 200
+        
         if delete_for_all:
             message.is_deleted = True
-            db.session.commit()
         else:
             # For user-only deletion, we'll treat it the same for simplicity
             message.is_deleted = True
-            db.session.commit()
+        if message.private_room_id:
+            db.session.flush()
+            refresh_private_room_summary(message.private_room_id)
         
         # Determine room for WebSocket
         if message.private_room_id:
@@ -478,6 +1912,11 @@ def delete_message(message_id):
         else:
             room_for_socket = None
         
+        if room_for_socket:
+            forget_unread(room_for_socket, message)
+        unindex_message(message)
+        db.session.commit()
+        
         # Send delete notification via WebSocket
         if room_for_socket:
             socketio.emit('message_deleted', {
@@ -495,6 +1934,7 @@ def delete_message(message_id):
 # Upload file
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
+    stored_name = None
     try:
         if 'file' not in request.files:
             return jsonify({"error": "No file part"}), 400
@@ -509,13 +1949,9 @@ def upload_file():
             return jsonify({"error": "No selected file"}), 400
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = int(time.time())
-            filename = f"{timestamp}_{filename}"
-            
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            file_url = f"/static/uploads/{filename}"
+            stored_name = store_upload(file)
+            db.session.commit()
+            file_url = f"/static/uploads/{stored_name}"
             return jsonify({
                 "success": True,
                 "fileUrl": file_url,
@@ -525,6 +1961,9 @@ def upload_file():
             return jsonify({"error": "File type not allowed"}), 400
     except Exception as e:
         print(f"Error in upload_file: {str(e)}")
+        db.session.rollback()
+        if stored_name:
+            delete_unreferenced_upload(stored_name)
         return jsonify({"error": str(e)}), 500
 
 # Get user profile
@@ -558,11 +1997,11 @@ def update_profile():
             return jsonify({"error": "Wallet address required"}), 400
         
         user = User.query.get(wallet_address)
+        old_avatar = user.avatar if user else None
         if user:
             user.display_name = data.get('displayName', user.display_name)
             user.avatar = data.get('avatar', user.avatar)
             user.bio = data.get('bio', user.bio)
-            user.last_active = datetime.now()
         else:
             user = User(
                 wallet_address=wallet_address,
@@ -572,7 +2011,15 @@ def update_profile():
             )
             db.session.add(user)
         
+        # An avatar pointing at a stored upload holds a reference to it
+        avatar_changed = user.avatar != old_avatar
+        if avatar_changed:
+            retain_upload(user.avatar)
         db.session.commit()
+        if avatar_changed:
+            release_upload(old_avatar)
+        presence_tracker.touch(wallet_address)
+        remember_user(user)
         
         # Send profile update via WebSocket
         socketio.emit('profile_updated', user.to_dict())
@@ -586,6 +2033,7 @@ def update_profile():
 # Upload avatar
 @app.route('/api/profile/avatar', methods=['POST'])
 def upload_avatar():
+    stored_name = None
     try:
         if 'avatar' not in request.files:
             return jsonify({"error": "No avatar file"}), 400
@@ -600,18 +2048,13 @@ def upload_avatar():
             return jsonify({"error": "No selected file"}), 400
         
         if avatar and allowed_file(avatar.filename):
-            filename = secure_filename(avatar.filename)
-            timestamp = int(time.time())
-            filename = f"avatar_{wallet_address[:6]}_{timestamp}_{filename}"
-            
-            avatar_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            avatar.save(avatar_path)
-            avatar_url = f"/static/uploads/{filename}"
+            stored_name = store_upload(avatar)
+            avatar_url = f"/static/uploads/{stored_name}"
             
             user = User.query.get(wallet_address)
+            old_avatar = user.avatar if user else None
             if user:
                 user.avatar = avatar_url
-                user.last_active = datetime.now()
             else:
                 user = User(
                     wallet_address=wallet_address,
@@ -619,7 +2062,12 @@ def upload_avatar():
                 )
                 db.session.add(user)
             
+            # Counts the new avatar's reference together with the profile change
             db.session.commit()
+            # Give back the old avatar's reference
+            release_upload(old_avatar)
+            presence_tracker.touch(wallet_address)
+            remember_user(user)
             
             # Send profile update via WebSocket
             socketio.emit('profile_updated', user.to_dict())
@@ -633,6 +2081,8 @@ def upload_avatar():
     except Exception as e:
         print(f"Error in upload_avatar: {str(e)}")
         db.session.rollback()
+        if stored_name:
+            delete_unreferenced_upload(stored_name)
         return jsonify({"error": str(e)}), 500
 
 # Get available rooms
@@ -645,70 +2095,45 @@ def get_rooms():
 @app.route('/api/users/active', methods=['GET'])
 def get_active_users():
     try:
-        # Get users active in the last 5 minutes
-        five_minutes_ago = datetime.now() - timedelta(minutes=5)
+        # Served from the presence tracker, which holds everyone active in the last 5 minutes.
+        # Pass ?since=<version> for only the joins, leaves and profile changes after it.
+        since = request.args.get('since')
+        if since:
+            delta = presence_tracker.changes_since(since)
+            if delta:
+                version, users, left = delta
+                return jsonify({"version": version, "full": False, "users": users, "left": left})
         
-        # Fixed query to avoid using timestamp() method
-        active_users = User.query.filter(
-            User.last_active > five_minutes_ago
-        ).all()
+        version, users, body = presence_tracker.snapshot()
+        if since:
+            return jsonify({"version": version, "full": True, "users": users, "left": []})
         
-        return jsonify({user.wallet_address: user.to_dict() for user in active_users})
+        etag = f'"{version}"'
+        if version in request.if_none_match:
+            return app.response_class(status=304, headers={'ETag': etag})
+        return app.response_class(body, mimetype='application/json', headers={
+            'ETag': etag,
+            'X-Presence-Version': version
+        })
     except Exception as e:
         print(f"Error in get_active_users: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 # Get network status
+# Served from the background network sampler; `age` is how many seconds old the
+# last good sample is, and `connected` turns false while the endpoint is failing.
+# Mock data stands in when no RPC endpoint is configured.
 @app.route('/api/network-status', methods=['GET'])
 def network_status():
     try:
-        if web3_available and w3 and w3.is_connected():
-            try:
-                latest_block = w3.eth.block_number
-                gas_price = w3.eth.gas_price
-                chain_id = w3.eth.chain_id
-                
-                try:
-                    block = w3.eth.get_block('latest')
-                    block_timestamp = block.timestamp
-                    block_transactions = len(block.transactions)
-                    block_hash = block.hash.hex()
-                except Exception as e:
-                    print(f"Error getting block data: {str(e)}")
-                    block_timestamp = int(time.time())
-                    block_transactions = 100
-                    block_hash = "0x1234567890abcdef1234567890abcdef1234567890abcdef1234567890abcdef"
-                
-                return jsonify({
-                    "connected": True,
-                    "latestBlock": latest_block,
-                    "gasPrice": str(gas_price),
-                    "chainId": chain_id,
-                    "blockTimestamp": block_timestamp,
-                    "blockTransactions": block_transactions,
-                    "blockHash": block_hash
-                })
-            except Exception as e:
-                print(f"Error getting blockchain data: {str(e)}")
-                return jsonify({
-                    "connected": True,
-                    "latestBlock": 12345678,
-                    "gasPrice": "50000000000",
-                    "chainId": 137,
-                    "blockTimestamp": int(time.time()),
-                    "blockTransactions": 100,
-                    "blockHash": "0x1234567890abcdef1234567890abcdef1234567890abcdef1234567890abcdef"
-                })
-        else:
-            return jsonify({
-                "connected": True,
-                "latestBlock": 12345678,
-                "gasPrice": "50000000000",
-                "chainId": 137,
-                "blockTimestamp": int(time.time()),
-                "blockTransactions": 100,
-                "blockHash": "0x1234567890abcdef1234567890abcdef1234567890abcdef1234567890abcdef"
-            })
+        snapshot = network_sampler.current()
+        if snapshot:
+            return jsonify(snapshot)
+        return jsonify(dict(
+            MOCK_NETWORK_STATUS,
+            blockTimestamp=int(time.time()),
+            age=0
+        ))
     except Exception as e:
         print(f"Error in network_status: {str(e)}")
         return jsonify({"error": str(e), "connected": False}), 500
@@ -724,9 +2149,14 @@ def update_user_presence():
         if not wallet_address:
             return jsonify({"error": "Wallet address required"}), 400
         
+        # Heartbeats from known users with an unchanged name never touch the database
+        known_name = presence_tracker.display_name(wallet_address)
+        if known_name is not None and (not data.get('name') or data.get('name') == known_name):
+            presence_tracker.touch(wallet_address)
+            return jsonify({"status": "success"}), 200
+        
         user = User.query.get(wallet_address)
         if user:
-            user.last_active = datetime.now()
             if data.get('name') and user.display_name != data.get('name'):
                 user.display_name = data.get('name')
         else:
@@ -744,6 +2174,8 @@ def update_user_presence():
             })
         
         db.session.commit()
+        presence_tracker.touch(wallet_address)
+        remember_user(user)
         return jsonify({"status": "success"}), 200
     except Exception as e:
         print(f"Error in update_user_presence: {str(e)}")
@@ -759,12 +2191,24 @@ def search_users():
     if not query or len(query) < 3:
         return jsonify({"error": "Search query must be at least 3 characters"}), 400
     
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
     try:
-        # Search in wallet addresses and display names
-        users = User.query.filter(
-            (User.wallet_address.like(f"%{query}%")) | 
-            (User.display_name.like(f"%{query}%"))
-        ).limit(10).all()
+        match = build_user_match(query) if app.config.get('USER_SEARCH_FTS') else None
+        if match:
+            # Prefix search over the FTS index, best bm25 rank first
+            users = User.query.from_statement(text(
+                "SELECT users.* FROM users_fts JOIN users ON users.wallet_address = users_fts.wallet_address "
+                "WHERE users_fts MATCH :match ORDER BY users_fts.rank LIMIT :limit OFFSET :offset"
+            )).params(match=match, limit=limit, offset=offset).all()
+        else:
+            # Search in wallet addresses and display names
+            pattern = like_pattern(query)
+            users = User.query.filter(
+                (User.wallet_address.like(pattern, escape='\\')) | 
+                (User.display_name.like(pattern, escape='\\'))
+            ).order_by(User.wallet_address).limit(limit).offset(offset).all()
         
         return jsonify([user.to_dict() for user in users])
     except Exception as e:
@@ -871,6 +2315,10 @@ def handle_friend_request(action):
             # Create private chat room
             private_room = PrivateChatRoom(sender_id, receiver_id)
             db.session.add(private_room)
+            
+            # Both participants start with an empty unread count
+            for user_id in (sender_id, receiver_id):
+                db.session.add(ReadCursor(user_id, f"private_{private_room.id}", last_read_at=datetime.utcnow()))
             db.session.commit()
             
             # Send friend request accepted notification via WebSocket
@@ -922,110 +2370,136 @@ def get_friends():
     if not wallet_address:
         return jsonify({"error": "Wallet address required"}), 400
     
+    limit = request.args.get('limit', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
     user = User.query.get(wallet_address)
     if not user:
         return jsonify({"error": "User not found"}), 404
     
+    # Find each friend's private chat room in the same query
+    private_room_id = select(PrivateChatRoom.id).where(or_(
+        and_(PrivateChatRoom.user1_id == wallet_address, PrivateChatRoom.user2_id == User.wallet_address),
+        and_(PrivateChatRoom.user1_id == User.wallet_address, PrivateChatRoom.user2_id == wallet_address)
+    )).limit(1).correlate(User).scalar_subquery()
+    
+    query = db.session.query(User, private_room_id).join(
+        friends, friends.c.friend_id == User.wallet_address
+    ).filter(
+        friends.c.user_id == wallet_address
+    ).order_by(friends.c.created_at, User.wallet_address).offset(offset)
+    if limit is not None:
+        query = query.limit(max(1, min(limit, 200)))
+    
     # Get friends list
     friend_list = []
-    for friend in user.friends_rel:
-        # Find private chat room
-        private_room = PrivateChatRoom.query.filter(
-            ((PrivateChatRoom.user1_id == wallet_address) & (PrivateChatRoom.user2_id == friend.wallet_address)) |
-            ((PrivateChatRoom.user1_id == friend.wallet_address) & (PrivateChatRoom.user2_id == wallet_address))
-        ).first()
-        
+    for friend, room_id in query.all():
         friend_data = friend.to_dict()
-        if private_room:
-            friend_data['privateRoomId'] = private_room.id
+        if room_id:
+            friend_data['privateRoomId'] = room_id
         
         friend_list.append(friend_data)
     
     return jsonify(friend_list)
 
 # Get friend requests
+# `status` filters by pending, accepted, rejected or all (received defaults to
+# pending, sent to all). Requests come newest first; all of them unless a
+# `limit` (at most 200) is given, with `offset` to page through them.
 @app.route('/api/friends/requests', methods=['GET'])
 def get_friend_requests():
     wallet_address = request.args.get('walletAddress')
     request_type = request.args.get('type', 'received')  # received or sent
+    status = request.args.get('status', 'pending' if request_type == 'received' else 'all')
+    limit = request.args.get('limit', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
     
     if not wallet_address:
         return jsonify({"error": "Wallet address required"}), 400
+    if status not in ['pending', 'accepted', 'rejected', 'all']:
+        return jsonify({"error": "Invalid status"}), 400
     
     if request_type == 'received':
-        # Get received friend requests
-        requests = db.session.query(friend_requests).filter_by(
-            receiver_id=wallet_address, status='pending'
-        ).all()
-        
-        result = []
-        for req in requests:
-            sender = User.query.get(req.sender_id)
-            if sender:
-                result.append({
-                    'senderId': sender.wallet_address,
-                    'senderName': sender.display_name,
-                    'senderAvatar': sender.avatar,
-                    'status': req.status,
-                    'createdAt': req.created_at.isoformat() if req.created_at else None
-                })
-        
-        return jsonify(result)
+        # Get received friend requests with their senders
+        own_column, other_column = friend_requests.c.receiver_id, friend_requests.c.sender_id
     else:  # sent
-        # Get sent friend requests
-        requests = db.session.query(friend_requests).filter_by(
-            sender_id=wallet_address
-        ).all()
-        
-        result = []
-        for req in requests:
-            receiver = User.query.get(req.receiver_id)
-            if receiver:
-                result.append({
-                    'receiverId': receiver.wallet_address,
-                    'receiverName': receiver.display_name,
-                    'receiverAvatar': receiver.avatar,
-                    'status': req.status,
-                    'createdAt': req.created_at.isoformat() if req.created_at else None
-                })
-        
-        return jsonify(result)
+        # Get sent friend requests with their receivers
+        own_column, other_column = friend_requests.c.sender_id, friend_requests.c.receiver_id
+    
+    query = db.session.query(
+        friend_requests.c.status, friend_requests.c.created_at, User
+    ).join(
+        User, User.wallet_address == other_column
+    ).filter(own_column == wallet_address)
+    if status != 'all':
+        query = query.filter(friend_requests.c.status == status)
+    query = query.order_by(
+        friend_requests.c.created_at.desc(), other_column
+    ).offset(offset)
+    if limit is not None:
+        query = query.limit(max(1, min(limit, 200)))
+    rows = query.all()
+    
+    prefix = 'sender' if request_type == 'received' else 'receiver'
+    result = []
+    for req_status, created_at, other_user in rows:
+        result.append({
+            f'{prefix}Id': other_user.wallet_address,
+            f'{prefix}Name': other_user.display_name,
+            f'{prefix}Avatar': other_user.avatar,
+            'status': req_status,
+            'createdAt': created_at.isoformat() if created_at else None
+        })
+    
+    return jsonify(result)
 
 # Get private chats
 @app.route('/api/private-chats', methods=['GET'])
 def get_private_chats():
     wallet_address = request.args.get('walletAddress')
+    limit = request.args.get('limit', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
     
     if not wallet_address:
         return jsonify({"error": "Wallet address required"}), 400
     
-    # Get all private chats for user
-    private_rooms = PrivateChatRoom.query.filter(
+    # Get private chats for user with the other participant and last message, newest first
+    other_user_id = case(
+        (PrivateChatRoom.user1_id == wallet_address, PrivateChatRoom.user2_id),
+        else_=PrivateChatRoom.user1_id
+    )
+    query = db.session.query(PrivateChatRoom, User, Message).join(
+        User, User.wallet_address == other_user_id
+    ).outerjoin(
+        Message, and_(Message.id == PrivateChatRoom.last_message_id, Message.is_deleted == False)
+    ).filter(
         (PrivateChatRoom.user1_id == wallet_address) | (PrivateChatRoom.user2_id == wallet_address)
-    ).all()
+    ).order_by(
+        PrivateChatRoom.last_activity.desc(), PrivateChatRoom.id
+    ).offset(offset)
+    if limit is not None:
+        query = query.limit(max(1, min(limit, 200)))
+    rows = query.all()
+    
+    other_users = [other_user for _, other_user, _ in rows]
+    last_messages = serialize_messages(
+        [last_message for _, _, last_message in rows if last_message],
+        known_users=other_users
+    )
+    last_messages = {msg['id']: msg for msg in last_messages}
     
     result = []
-    for room in private_rooms:
-        # Determine other user in chat
-        other_user_id = room.user2_id if room.user1_id == wallet_address else room.user1_id
-        other_user = User.query.get(other_user_id)
-        
-        if other_user:
-            # Get last message in chat
-            last_message = Message.query.filter_by(
-                private_room_id=room.id, is_deleted=False
-            ).order_by(Message.timestamp.desc()).first()
-            
-            chat_data = {
-                'id': room.id,
-                'userId': other_user.wallet_address,
-                'displayName': other_user.display_name,
-                'avatar': other_user.avatar,
-                'lastActive': other_user.last_active.isoformat() if other_user.last_active else None,
-                'lastMessage': last_message.to_dict() if last_message else None
-            }
-            
-            result.append(chat_data)
+    for room, other_user, last_message in rows:
+        chat_data = {
+            'id': room.id,
+            'userId': other_user.wallet_address,
+            'displayName': other_user.display_name,
+            'avatar': other_user.avatar,
+            'lastActive': other_user.last_active.isoformat() if other_user.last_active else None,
+            'lastMessage': last_messages.get(last_message.id) if last_message else None
+        }
+        
+        result.append(chat_data)
     
     return jsonify(result)
 
@@ -1039,15 +2513,22 @@ def handle_connect():
 def handle_disconnect():
     print('Client disconnected')
 
+# Send a message over the socket instead of POST /api/messages. The handler's
+# return value is the Socket.IO ack: {"ok": true, "message": {...}} with the
+# stored id, or {"ok": false, "error": "..."}.
 @socketio.on('send_message')
 def handle_send_message(data):
     try:
-        message = Message.query.get(data['messageId'])
-        if message:
-            room = f"room_{message.room_id}" if message.room_id else f"private_{message.private_room_id}"
-            emit('new_message', message.to_dict(), room=room)
+        if not isinstance(data, dict):
+            return {"ok": False, "error": "No data provided"}
+        body, status = send_chat_message(data)
+        if status >= 400:
+            return {"ok": False, "error": body["error"]}
+        return {"ok": True, "message": body}
     except Exception as e:
-        print(f"Error sending message via socket: {str(e)}")    
+        print(f"Error sending message via socket: {str(e)}")
+        db.session.rollback()
+        return {"ok": False, "error": str(e)}
 
 @socketio.on('join')
 def handle_join(data):
@@ -1057,9 +2538,7 @@ def handle_join(data):
         
         if room_type == 'public':
             # Join public room
-            room = ChatRoom.query.filter_by(name=room_id).first()
-            if not room:
-                room = ChatRoom.query.get(room_id)
+            room = room_registry.resolve(room_id)
             
             if room:
                 join_room(f"room_{room.id}")
@@ -1067,17 +2546,24 @@ def handle_join(data):
                 emit('joined', {'room': room.name, 'type': 'public'})
         elif room_type == 'private':
             # Join private chat
-            private_room = PrivateChatRoom.query.get(room_id)
-            if private_room:
-                join_room(f"private_{private_room.id}")
-                print(f"Client joined private room: {private_room.id}")
-                emit('joined', {'room': private_room.id, 'type': 'private'})
+            private_room_id = room_registry.resolve_private(room_id)
+            if private_room_id:
+                join_room(f"private_{private_room_id}")
+                print(f"Client joined private room: {private_room_id}")
+                emit('joined', {'room': private_room_id, 'type': 'private'})
         elif room_type == 'user':
             # Join user room for notifications
             user_id = room_id
             join_room(f"user_{user_id}")
             print(f"Client joined user room: {user_id}")
             emit('joined', {'room': user_id, 'type': 'user'})
+        elif room_type == 'network':
+            # Join network status updates, starting with the current snapshot
+            join_room(NETWORK_STATUS_ROOM)
+            emit('joined', {'room': NETWORK_STATUS_ROOM, 'type': 'network'})
+            snapshot = network_sampler.current()
+            if snapshot:
+                emit('network_status', snapshot)
     except Exception as e:
         print(f"Error in handle_join: {str(e)}")
 
@@ -1088,22 +2574,22 @@ def handle_leave(data):
         room_id = data.get('roomId')
         
         if room_type == 'public':
-            room = ChatRoom.query.filter_by(name=room_id).first()
-            if not room:
-                room = ChatRoom.query.get(room_id)
+            room = room_registry.resolve(room_id)
                 
             if room:
                 leave_room(f"room_{room.id}")
                 print(f"Client left public room: {room.name}")
         elif room_type == 'private':
-            private_room = PrivateChatRoom.query.get(room_id)
-            if private_room:
-                leave_room(f"private_{private_room.id}")
-                print(f"Client left private room: {private_room.id}")
+            private_room_id = room_registry.resolve_private(room_id)
+            if private_room_id:
+                leave_room(f"private_{private_room_id}")
+                print(f"Client left private room: {private_room_id}")
         elif room_type == 'user':
             user_id = room_id
             leave_room(f"user_{user_id}")
             print(f"Client left user room: {user_id}")
+        elif room_type == 'network':
+            leave_room(NETWORK_STATUS_ROOM)
     except Exception as e:
         print(f"Error in handle_leave: {str(e)}")
 
@@ -1120,24 +2606,25 @@ def handle_typing(data):
         
         room_name = None
         if room_type == 'public':
-            room = ChatRoom.query.filter_by(name=room_id).first()
-            if not room:
-                room = ChatRoom.query.get(room_id)
+            room = room_registry.resolve(room_id)
                 
             if room:
                 room_name = f"room_{room.id}"
         elif room_type == 'private':
-            private_room = PrivateChatRoom.query.get(room_id)
-            if private_room:
-                room_name = f"private_{private_room.id}"
+            private_room_id = room_registry.resolve_private(room_id)
+            if private_room_id:
+                room_name = f"private_{private_room_id}"
         
         if room_name:
-            user = User.query.get(user_id)
-            emit('user_typing', {
-                'userId': user_id,
-                'displayName': user.display_name if user else f"User {user_id[:6]}",
-                'isTyping': is_typing
-            }, room=room_name, include_self=False)
+            # Warm the name cache so the flush thread never touches the database
+            display_name = typing_aggregator.display_name(user_id)
+            if typing_aggregator.update(room_name, user_id, is_typing):
+                share_state('typing', {
+                    'room': room_name,
+                    'userId': user_id,
+                    'displayName': display_name,
+                    'isTyping': is_typing
+                })
     except Exception as e:
         print(f"Error in handle_typing: {str(e)}")
 
@@ -1155,7 +2642,9 @@ def find_free_port():
         return s.getsockname()[1]
 
 if __name__ == '__main__':
-   
-    socketio.run(app,allow_unsafe_werkzeug=True)
+    create_app()
+    # Development server; see serve.py for production and for running several processes
+    socketio.run(app, host=os.environ.get('HOST', '127.0.0.1'),
+                 port=int(os.environ.get('PORT', 5000)), allow_unsafe_werkzeug=True)
 
 
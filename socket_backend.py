@@ -0,0 +1,154 @@
+"""Socket.IO fan-out backend for polychat.
+
+With a message queue configured, every server process publishes its emits
+to a shared channel. Emits from any process therefore reach clients
+connected to any other process:
+
+    SOCKETIO_MESSAGE_QUEUE   redis://host:6379/0, amqp://..., kafka://...,
+                             zmq+tcp://..., or local:// (in-process broker)
+    SOCKETIO_CHANNEL         channel name shared by the servers (default
+                             flask-socketio)
+
+Without SOCKETIO_MESSAGE_QUEUE, rooms live in process memory as before.
+local:// fans out between the SocketIO servers of a single process. It
+stands in for a real broker in tests and exercises the same publish/listen
+path as the networked backends.
+
+Every client manager built here also carries what polychat needs to run as
+several server processes on one queue (see ClusterMixin): skip_sid may name
+rooms, which each process resolves to the sessions it holds, and state
+changes such as blocks can be shared with the other processes.
+"""
+import os
+import queue
+import threading
+
+import socketio
+
+DEFAULT_CHANNEL = 'flask-socketio'
+# State changes travel as emits to this namespace; no client ever joins it
+STATE_NAMESPACE = '/polychat-state'
+
+
+class ClusterMixin:
+    """Client manager features for running polychat as several processes.
+    
+    Put it ahead of a socketio manager class (see cluster_manager). It adds:
+    
+    - skip_sid entries may name rooms. They are resolved to session ids by
+      each process at delivery, from the rooms it holds, so one emit can
+      skip every session of a user wherever that user is connected.
+    - share(name, change) sends a JSON-able state change to the other
+      processes on the channel, where the handler registered with
+      on_state(name, handler) applies it. The sender applies its own change
+      itself, and without a queue share() does nothing.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._state_handlers = {}
+    
+    def on_state(self, name, handler):
+        self._state_handlers[name] = handler
+    
+    def share(self, name, change):
+        if isinstance(self, socketio.PubSubManager):
+            self._publish({'method': 'emit', 'event': name, 'data': [change], 'binary': False,
+                           'namespace': STATE_NAMESPACE, 'room': None, 'skip_sid': None,
+                           'callback': None, 'host_id': self.host_id})
+    
+    def local_sids(self, namespace, skip_sid):
+        """Resolve skip_sid entries, session ids or rooms, to the sessions of this process."""
+        if not skip_sid:
+            return skip_sid
+        rooms = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+        # Every session is also in a room named after its own id
+        return [sid for sid, _ in self.get_participants(namespace, rooms)]
+    
+    def emit(self, event, data, namespace=None, room=None, skip_sid=None, **kwargs):
+        # Queued emits are resolved by _handle_emit in each process instead
+        if kwargs.get('ignore_queue') or not isinstance(self, socketio.PubSubManager):
+            skip_sid = self.local_sids(namespace or '/', skip_sid)
+        return super().emit(event, data, namespace=namespace, room=room, skip_sid=skip_sid, **kwargs)
+    
+    def _handle_emit(self, message):
+        if message.get('namespace') == STATE_NAMESPACE:
+            handler = self._state_handlers.get(message.get('event'))
+            if handler:
+                handler(message['data'][0])
+            return
+        # The sender publishes this same dict after handling it, so copy it
+        message = dict(message, skip_sid=self.local_sids(message.get('namespace') or '/',
+                                                         message.get('skip_sid')))
+        super()._handle_emit(message)
+
+
+def cluster_manager(manager_class):
+    """Return a subclass of a socketio manager class with ClusterMixin."""
+    return type(manager_class.__name__, (ClusterMixin, manager_class), {})
+
+
+
+class LocalManager(socketio.PubSubManager):
+    """Pub/sub client manager backed by an in-process broker."""
+    name = 'local'
+
+    _lock = threading.Lock()
+    _subscribers = {}  # channel -> list of subscriber queues
+
+    def __init__(self, channel=DEFAULT_CHANNEL, write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self._inbox = queue.Queue()
+        if not write_only:
+            with self._lock:
+                self._subscribers.setdefault(channel, []).append(self._inbox)
+
+    def _publish(self, data):
+        # Encode like a networked broker would, so payloads must survive JSON
+        message = self.json.dumps(data)
+        with self._lock:
+            inboxes = list(self._subscribers.get(self.channel, ()))
+        for inbox in inboxes:
+            inbox.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+    def close(self):
+        """Stop receiving messages from the broker."""
+        with self._lock:
+            inboxes = self._subscribers.get(self.channel, [])
+            if self._inbox in inboxes:
+                inboxes.remove(self._inbox)
+
+
+def socketio_options():
+    """Return the SocketIO keyword arguments for the configured backend."""
+    url = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    channel = os.environ.get('SOCKETIO_CHANNEL', DEFAULT_CHANNEL)
+    if not url:
+        return {'client_manager': cluster_manager(socketio.Manager)()}
+    if url.startswith('local://'):
+        return {'client_manager': cluster_manager(LocalManager)(channel)}
+    # Picked from the URL the way Flask-SocketIO does for message_queue
+    if url.startswith(('redis://', 'rediss://')):
+        manager_class = socketio.RedisManager
+    elif url.startswith('kafka://'):
+        manager_class = socketio.KafkaManager
+    elif url.startswith('zmq'):
+        manager_class = socketio.ZmqManager
+    else:
+        manager_class = socketio.KombuManager
+    return {'client_manager': cluster_manager(manager_class)(url, channel=channel)}
+
+
+def start_listening(server):
+    """Start receiving from the queue now rather than at the first client connection.
+    
+    Shared state changes must reach a process even before any client
+    connects to it.
+    """
+    if not server.manager_initialized:
+        server.manager_initialized = True
+        server.manager.initialize()
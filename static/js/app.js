@@ -55,6 +55,8 @@ let currentRoom = "General"
 let currentPrivateRoom = null
 let rooms = {}
 let activeUsers = {}
+let activeUsersVersion = null
+let networkStatusLoaded = false
 let friends = []
 let friendRequests = []
 let privateChats = []
@@ -156,6 +158,11 @@ function initializeSocket() {
   // Socket event listeners
   socket.on("connect", () => {
     console.log("Connected to WebSocket server")
+    // Subscribe to block and gas updates
+    socket.emit("join", {
+      type: "network",
+    })
+
     // Join the current room
     if (currentAccount) {
       // Join user's personal room for notifications
@@ -180,6 +187,10 @@ function initializeSocket() {
     }
   })
 
+  socket.on("network_status", (data) => {
+    renderNetworkStatus(data)
+  })
+
   socket.on("disconnect", () => {
     console.log("Disconnected from WebSocket server")
   })
@@ -201,6 +212,8 @@ function initializeSocket() {
       addMessageToUI(message)
       // Scroll to bottom
       messagesContainer.scrollTop = messagesContainer.scrollHeight
+      // The user is looking at this room, so the message is read
+      scheduleMarkRoomRead(message.id)
     }
   })
 
@@ -227,20 +240,39 @@ function initializeSocket() {
     }
   })
 
-  socket.on("user_typing", (data) => {
-    if (data.userId !== currentAccount && !isUserBlocked(data.userId)) {
-      if (data.isTyping) {
-        // Show typing indicator
-        const userName = data.displayName || `User ${data.userId.substring(0, 6)}`
-        document.querySelector(".typing-text").textContent = `${userName} is typing...`
-        typingIndicator.classList.remove("hidden")
-      } else {
-        // Hide typing indicator
-        typingIndicator.classList.add("hidden")
-      }
+  // A message we sent was shown right away but could not be saved
+  socket.on("message_failed", (data) => {
+    console.error("Message could not be saved:", data)
+    const messageElement = document.querySelector(`.message[data-id="${data.messageId}"]`)
+    if (messageElement) {
+      messageElement.remove()
+      showNotification("Failed to send message: " + data.error, "error")
     }
   })
 
+  // The server sends one coalesced "who is typing" frame per room
+  socket.on("typing_users", (data) => {
+    const typists = data.users.filter((user) => user.userId !== currentAccount && !isUserBlocked(user.userId))
+    if (typists.length === 0) {
+      // Hide typing indicator
+      typingIndicator.classList.add("hidden")
+      return
+    }
+
+    // Show typing indicator
+    const names = typists.map((user) => user.displayName || `User ${user.userId.substring(0, 6)}`)
+    let text
+    if (names.length === 1) {
+      text = `${names[0]} is typing...`
+    } else if (names.length === 2) {
+      text = `${names[0]} and ${names[1]} are typing...`
+    } else {
+      text = "Several people are typing..."
+    }
+    document.querySelector(".typing-text").textContent = text
+    typingIndicator.classList.remove("hidden")
+  })
+
   socket.on("user_connected", (data) => {
     console.log("User connected:", data)
     if (!isUserBlocked(data.userId)) {
@@ -1696,29 +1728,36 @@ function updateNetworkUI() {
   }
 }
 
-// Poll network status
-async function pollNetworkStatus() {
-  try {
-    const response = await fetch("/api/network-status")
-    const data = await response.json()
+// Render network status from the socket feed or the HTTP fallback
+function renderNetworkStatus(data) {
+  if (data.connected) {
+    connectionStatus.classList.remove("offline")
+    connectionStatus.classList.add("online")
+    statusText.textContent = "Connected to Polygon"
 
-    if (data.connected) {
-      connectionStatus.classList.remove("offline")
-      connectionStatus.classList.add("online")
-      statusText.textContent = "Connected to Polygon"
+    chainIdElement.textContent = data.chainId
+    latestBlockElement.textContent = data.latestBlock
 
-      chainIdElement.textContent = data.chainId
-      latestBlockElement.textContent = data.latestBlock
+    // Convert gas price from wei to gwei
+    const gasPriceGwei = web3
+      ? web3.utils.fromWei(data.gasPrice, "gwei")
+      : (Number.parseInt(data.gasPrice) / 1e9).toFixed(2)
+    gasPriceElement.textContent = `${gasPriceGwei} Gwei`
+  } else {
+    connectionStatus.classList.remove("online")
+    connectionStatus.classList.add("offline")
+    statusText.textContent = "Server disconnected"
+  }
+}
 
-      // Convert gas price from wei to gwei
-      const gasPriceGwei = web3
-        ? web3.utils.fromWei(data.gasPrice, "gwei")
-        : (Number.parseInt(data.gasPrice) / 1e9).toFixed(2)
-      gasPriceElement.textContent = `${gasPriceGwei} Gwei`
-    } else {
-      connectionStatus.classList.remove("online")
-      connectionStatus.classList.add("offline")
-      statusText.textContent = "Server disconnected"
+// Poll network status
+// While the socket is connected, updates arrive on the network_status feed instead
+async function pollNetworkStatus() {
+  try {
+    if (!networkStatusLoaded || !(socket && socket.connected)) {
+      const response = await fetch("/api/network-status")
+      renderNetworkStatus(await response.json())
+      networkStatusLoaded = true
     }
   } catch (error) {
     console.error("Error polling network status:", error)
@@ -1836,10 +1875,25 @@ function switchRoom(roomId) {
 }
 
 // Poll active users
+// After the first full load only joins, leaves and profile changes are fetched
 async function pollActiveUsers() {
   try {
-    const response = await fetch("/api/users/active")
-    activeUsers = await response.json()
+    const url = activeUsersVersion ? `/api/users/active?since=${activeUsersVersion}` : "/api/users/active"
+    const response = await fetch(url)
+    const data = await response.json()
+
+    if (!activeUsersVersion) {
+      activeUsers = data
+      activeUsersVersion = response.headers.get("X-Presence-Version")
+    } else {
+      if (data.full) {
+        activeUsers = data.users
+      } else {
+        Object.assign(activeUsers, data.users)
+        data.left.forEach((userId) => delete activeUsers[userId])
+      }
+      activeUsersVersion = data.version
+    }
 
     updateActiveUsersList()
   } catch (error) {
@@ -1909,7 +1963,8 @@ async function loadMessages() {
     }
 
     const response = await fetch(url)
-    const messages = await response.json()
+    const data = await response.json()
+    const messages = data.messages
 
     // Clear messages container
     messagesContainer.innerHTML = ""
@@ -2004,12 +2059,91 @@ async function loadMessages() {
 
     // Scroll to bottom
     messagesContainer.scrollTop = messagesContainer.scrollHeight
+
+    // Everything just loaded counts as read
+    if (currentAccount && messages.length > 0) {
+      markRoomRead(messages[messages.length - 1].id)
+    }
   } catch (error) {
     console.error("Error loading messages:", error)
     showNotification("Failed to load messages", "error")
   }
 }
 
+// The room or private chat the user has open, as read-cursor fields
+function currentReadTarget() {
+  return {
+    room: isChatPrivate ? undefined : currentRoom,
+    privateRoomId: isChatPrivate ? currentPrivateRoom : undefined,
+  }
+}
+
+// Move the read cursor of the current room or private chat
+async function markRoomRead(messageId, target = currentReadTarget()) {
+  try {
+    await fetch("/api/read-cursors", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        walletAddress: currentAccount,
+        ...target,
+        messageId: messageId,
+      }),
+    })
+  } catch (error) {
+    console.error("Error marking room as read:", error)
+  }
+}
+
+// Debounced markRoomRead for messages arriving in the open room, one timer per room
+const markReadTimers = {}
+function scheduleMarkRoomRead(messageId) {
+  // Keep the room the message arrived in, even if the user switches before the timer fires
+  const target = currentReadTarget()
+  const key = JSON.stringify(target)
+  clearTimeout(markReadTimers[key])
+  markReadTimers[key] = setTimeout(() => {
+    delete markReadTimers[key]
+    markRoomRead(messageId, target)
+  }, 1000)
+}
+
+// Send a message over the socket; the server acknowledges with the stored message
+function sendMessageOverSocket(messageData) {
+  return new Promise((resolve, reject) => {
+    socket.timeout(10000).emit("send_message", messageData, (err, ack) => {
+      if (err) {
+        reject(new Error("Timed out waiting for the server"))
+      } else if (!ack || !ack.ok) {
+        reject(new Error((ack && ack.error) || "Message was rejected"))
+      } else {
+        resolve(ack.message)
+      }
+    })
+  })
+}
+
+// Fallback used while the socket is disconnected
+async function sendMessageOverHttp(messageData) {
+  const response = await fetch("/api/messages", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify(messageData),
+  })
+
+  if (!response.ok) {
+    const errorData = await response.text()
+    console.error(`Server responded with status: ${response.status}`, errorData)
+    throw new Error(`Server responded with status: ${response.status}`)
+  }
+
+  return response.json()
+}
+
 // Send message
 async function sendMessage() {
   const content = messageInput.value.trim()
@@ -2053,21 +2187,7 @@ async function sendMessage() {
 
     console.log("Sending message data:", messageData)
 
-    const response = await fetch("/api/messages", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify(messageData),
-    })
-
-    if (!response.ok) {
-      const errorData = await response.text()
-      console.error(`Server responded with status: ${response.status}`, errorData)
-      throw new Error(`Server responded with status: ${response.status}`)
-    }
-
-    const message = await response.json()
+    const message = socket && socket.connected ? await sendMessageOverSocket(messageData) : await sendMessageOverHttp(messageData)
     console.log("Message sent successfully:", message)
 
     // Add message to UI immediately for better user experience
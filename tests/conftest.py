@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app is configured once per process, so point it at a scratch database
+# before server is imported
+DATA_DIR = tempfile.mkdtemp(prefix='polychat-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DATA_DIR, 'polychat.db')}"
+os.environ.pop('SOCKETIO_MESSAGE_QUEUE', None)
+
+import server  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    # No background threads; tests that need one start it themselves
+    return server.create_app({
+        'UPLOAD_FOLDER': os.path.join(DATA_DIR, 'uploads'),
+        'POLYGON_RPC_URL': '',
+        'START_WORKERS': False
+    })
+
+
+@pytest.fixture(scope='session')
+def ingestor(app):
+    """Run the message writer thread, for tests that post messages."""
+    server.message_ingestor.start()
+    yield server.message_ingestor
+    server.message_ingestor.stop()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def room(app):
+    """A fresh public room, so tests do not see each other's messages."""
+    with app.app_context():
+        chat_room = server.ChatRoom(f"room-{os.urandom(4).hex()}", "Test room")
+        server.db.session.add(chat_room)
+        server.db.session.commit()
+        return chat_room.id
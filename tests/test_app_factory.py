@@ -0,0 +1,12 @@
+import pytest
+
+import server
+
+
+def test_create_app_returns_the_configured_app(app):
+    assert server.create_app() is app
+
+
+def test_create_app_rejects_late_config(app):
+    with pytest.raises(RuntimeError):
+        server.create_app({'START_WORKERS': False})
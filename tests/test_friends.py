@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import server
+
+RECEIVER = '0xfriend0000'
+
+
+def test_friend_requests_are_not_truncated_without_a_limit(app, client):
+    senders = [f'0xfriend{i:04}' for i in range(1, 61)]
+    started = datetime(2025, 1, 1)
+    with app.app_context():
+        server.db.session.add_all(server.User(wallet_address) for wallet_address in [RECEIVER] + senders)
+        server.db.session.flush()
+        server.db.session.execute(server.friend_requests.insert(), [
+            {'sender_id': sender, 'receiver_id': RECEIVER, 'status': 'pending',
+             'created_at': started + timedelta(minutes=i)}
+            for i, sender in enumerate(senders)
+        ])
+        server.db.session.commit()
+    
+    def received(**params):
+        response = client.get('/api/friends/requests', query_string=dict(params, walletAddress=RECEIVER))
+        assert response.status_code == 200
+        return [request['senderId'] for request in response.get_json()]
+    
+    newest_first = senders[::-1]
+    assert received() == newest_first
+    assert received(limit=10, offset=55) == newest_first[55:]
+    assert received(limit=0) == newest_first[:1]
+    assert received(limit=1000, offset=-5) == newest_first
+
+
+def test_friend_and_chat_lists_clamp_paging(app, client):
+    owner, friends = '0xpaging0000', [f'0xpaging{i:04}' for i in range(1, 4)]
+    with app.app_context():
+        server.db.session.add_all(server.User(wallet_address) for wallet_address in [owner] + friends)
+        server.db.session.flush()
+        server.db.session.execute(server.friends.insert(), [
+            {'user_id': owner, 'friend_id': friend} for friend in friends
+        ])
+        server.db.session.add_all(server.PrivateChatRoom(owner, friend) for friend in friends)
+        server.db.session.commit()
+    
+    for url in ('/api/friends', '/api/private-chats'):
+        def listed(**params):
+            response = client.get(url, query_string=dict(params, walletAddress=owner))
+            assert response.status_code == 200
+            return response.get_json()
+        assert len(listed()) == 3
+        assert len(listed(limit=-1)) == 1
+        assert len(listed(limit=1000, offset=-2)) == 3
@@ -0,0 +1,75 @@
+import uuid
+
+from sqlalchemy import text
+
+import server
+
+
+def insert_legacy_messages(app, room_id, count):
+    """Insert rows the way func.now() stored them: second precision, one shared second."""
+    ids = sorted(str(uuid.uuid4()) for _ in range(count))
+    with app.app_context():
+        for i, message_id in enumerate(ids):
+            server.db.session.execute(text(
+                "INSERT INTO messages (id, content, sender_id, room_id, type, is_deleted, timestamp) "
+                "VALUES (:id, :content, '0xlegacy', :room_id, 'text', 0, '2025-03-14 01:47:02')"
+            ), {'id': message_id, 'content': f'legacy {i}', 'room_id': room_id})
+        server.db.session.commit()
+        # Boot as if the database predated the timestamp migration
+        server.db.session.execute(text("PRAGMA user_version = 0"))
+        server.create_tables()
+    return ids
+
+
+def schema_version(app):
+    with app.app_context():
+        return server.db.session.execute(text("PRAGMA user_version")).scalar()
+
+
+def page_through(client, room_id, direction, cursor=None):
+    seen = []
+    for _ in range(10):
+        url = f'/api/messages?room={room_id}&limit=2'
+        if cursor:
+            url += f'&{direction}={cursor}'
+        data = client.get(url).get_json()
+        page = [message['id'] for message in data['messages']]
+        seen = page + seen if direction == 'before' else seen + page
+        cursor = data['nextCursor']
+        if not cursor:
+            break
+    return seen
+
+
+def test_paging_back_through_messages_sharing_a_second(app, client, room):
+    ids = insert_legacy_messages(app, room, 5)
+    assert page_through(client, room, 'before') == ids
+
+
+def test_paging_forward_through_messages_sharing_a_second(app, client, room):
+    ids = insert_legacy_messages(app, room, 5)
+    with app.app_context():
+        cursor = server.encode_cursor(server.db.session.get(server.Message, ids[0]))
+    assert page_through(client, room, 'after', cursor) == ids[1:]
+
+
+def test_limit_is_clamped(app, client, room):
+    insert_legacy_messages(app, room, 3)
+    assert len(client.get(f'/api/messages?room={room}&limit=0').get_json()['messages']) == 1
+    assert len(client.get(f'/api/messages?room={room}&limit=-1').get_json()['messages']) == 1
+
+
+def test_migrations_run_once(app, room):
+    assert schema_version(app) == len(server.SQLITE_MIGRATIONS)
+    with app.app_context():
+        server.db.session.execute(text(
+            "INSERT INTO messages (id, content, sender_id, room_id, type, is_deleted, timestamp) "
+            "VALUES (:id, 'late', '0xlegacy', :room_id, 'text', 0, '2025-03-14 01:47:02')"
+        ), {'id': str(uuid.uuid4()), 'room_id': room})
+        server.db.session.commit()
+        server.create_tables()
+        stored = server.db.session.execute(text(
+            "SELECT timestamp FROM messages WHERE room_id = :room_id"
+        ), {'room_id': room}).scalar()
+    # A migrated database is not scanned again on the next start
+    assert stored == '2025-03-14 01:47:02'
@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.usefixtures('ingestor')
+
+SENDER = '0xingest0001'
+
+
+def queued_message(app, room, content, message_id=None):
+    with app.app_context():
+        message = server.Message(content=content, sender_id=SENDER)
+    message.room_id = room
+    if message_id:
+        message.id = message_id
+    return message, f'room_{room}', server.IngestTicket()
+
+
+def stored(app, message_id):
+    with app.app_context():
+        return server.db.session.get(server.Message, message_id) is not None
+
+
+def test_durable_post_is_committed_before_the_response(app, client, room):
+    response = client.post('/api/messages?durable=true', json={
+        'content': 'durable', 'walletAddress': SENDER, 'room': room
+    })
+    assert response.status_code == 201
+    assert response.get_json()['persisted'] is True
+    assert stored(app, response.get_json()['id'])
+
+
+def test_failed_message_does_not_sink_its_batch(app, client, room):
+    existing = client.post('/api/messages?durable=true', json={
+        'content': 'first', 'walletAddress': SENDER, 'room': room
+    }).get_json()['id']
+    
+    # The duplicate primary key fails the batch insert; the retry isolates it
+    batch = [
+        queued_message(app, room, 'before'),
+        queued_message(app, room, 'duplicate', message_id=existing),
+        queued_message(app, room, 'after')
+    ]
+    server.message_ingestor._persist(batch)
+    
+    (good1, _, ticket1), (_, _, bad_ticket), (good2, _, ticket2) = batch
+    assert ticket1.persisted and ticket2.persisted
+    assert not bad_ticket.persisted and bad_ticket.error is not None
+    assert stored(app, good1.id) and stored(app, good2.id)
+
+
+def test_delete_right_after_post_finds_the_queued_message(client, room):
+    message_id = client.post('/api/messages', json={
+        'content': 'quick', 'walletAddress': SENDER, 'room': room
+    }).get_json()['id']
+    response = client.delete(f'/api/messages/{message_id}?walletAddress={SENDER}')
+    assert response.status_code == 200
+
+
+def received_events(socket_client, name, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        events = [event['args'][0] for event in socket_client.get_received() if event['name'] == name]
+        if events:
+            return events
+        time.sleep(0.02)
+    return []
+
+
+def test_messages_are_announced_only_after_their_commit(app, room):
+    announced = {}
+    
+    def announcer(message_id):
+        def announce(error):
+            # Runs on the writer thread, after the batch commit
+            announced[message_id] = (error is None, stored(app, message_id))
+        return announce
+    
+    batch = [queued_message(app, room, 'first'), queued_message(app, room, 'second')]
+    for message, _, ticket in batch:
+        ticket.announce = announcer(message.id)
+    server.message_ingestor._persist(batch)
+    assert announced == {message.id: (True, True) for message, _, _ in batch}
+
+
+def test_failed_write_retracts_instead_of_broadcasting(app, client, room, monkeypatch):
+    socket_client = server.socketio.test_client(app)
+    socket_client.emit('join', {'type': 'public', 'roomId': room})
+    socket_client.emit('join', {'type': 'user', 'roomId': SENDER})
+    socket_client.get_received()
+    
+    def fail(batch):
+        raise RuntimeError('disk full')
+    monkeypatch.setattr(server.message_ingestor, '_write', fail)
+    
+    response = client.post('/api/messages', json={'content': 'lost', 'walletAddress': SENDER, 'room': room})
+    message_id = response.get_json()['id']
+    failures = received_events(socket_client, 'message_failed')
+    assert failures == [{'messageId': message_id, 'error': 'disk full'}]
+    assert not stored(app, message_id)
+    socket_client.disconnect()
+
+
+def test_room_hears_of_a_message_once_it_is_saved(app, client, room):
+    socket_client = server.socketio.test_client(app)
+    socket_client.emit('join', {'type': 'public', 'roomId': room})
+    socket_client.get_received()
+    
+    message_id = client.post('/api/messages', json={
+        'content': 'heard', 'walletAddress': SENDER, 'room': room
+    }).get_json()['id']
+    assert [message['id'] for message in received_events(socket_client, 'new_message')] == [message_id]
+    assert stored(app, message_id)
+    socket_client.disconnect()
@@ -0,0 +1,82 @@
+import pytest
+from sqlalchemy import text
+
+import server
+
+pytestmark = pytest.mark.usefixtures('ingestor')
+
+MEMBER = '0xsearch0001'
+FRIEND = '0xsearch0002'
+OUTSIDER = '0xsearch0003'
+
+
+def post(client, content, **target):
+    response = client.post('/api/messages?durable=true', json=dict(
+        target, content=content, walletAddress=MEMBER
+    ))
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def search(client, wallet_address, query, **params):
+    response = client.get('/api/messages/search', query_string=dict(
+        params, walletAddress=wallet_address, query=query
+    ))
+    assert response.status_code == 200
+    return response.get_json()['messages']
+
+
+@pytest.fixture
+def private_room(app):
+    with app.app_context():
+        for wallet_address in (MEMBER, FRIEND):
+            if not server.db.session.get(server.User, wallet_address):
+                server.db.session.add(server.User(wallet_address))
+        chat = server.PrivateChatRoom(MEMBER, FRIEND)
+        server.db.session.add(chat)
+        server.db.session.commit()
+        return chat.id
+
+
+def test_search_survives_renumbered_rowids(app, client, room, private_room):
+    public_id = post(client, 'orchard apple pie', room=room)
+    private_id = post(client, 'orchard banana secret', privateRoomId=private_room)
+    
+    # What VACUUM may do to a table without an INTEGER PRIMARY KEY
+    with app.app_context():
+        rowids = dict(server.db.session.execute(text(
+            "SELECT id, rowid FROM messages WHERE id IN (:a, :b)"
+        ), {'a': public_id, 'b': private_id}).all())
+        swaps = [(public_id, -1), (private_id, rowids[public_id]), (public_id, rowids[private_id])]
+        for message_id, rowid in swaps:
+            server.db.session.execute(text("UPDATE messages SET rowid = :rowid WHERE id = :id"),
+                                      {'rowid': rowid, 'id': message_id})
+        server.db.session.commit()
+    
+    assert search(client, OUTSIDER, 'banana') == []
+    assert [m['id'] for m in search(client, MEMBER, 'banana')] == [private_id]
+    results = search(client, OUTSIDER, 'orchard')
+    assert [m['id'] for m in results] == [public_id]
+    assert results[0]['snippet'] == '<mark>orchard</mark> apple pie'
+
+
+def test_deleted_message_leaves_the_index(app, client, room):
+    message_id = post(client, 'a "quoted" walrus', room=room)
+    assert client.delete(f'/api/messages/{message_id}?walletAddress={MEMBER}').status_code == 200
+    with app.app_context():
+        remaining = server.db.session.execute(
+            server.messages_fts.select().where(server.messages_fts.c.id == message_id)
+        ).all()
+    assert remaining == []
+    assert search(client, MEMBER, 'walrus', room=room) == []
+
+
+def test_like_search_escapes_wildcards(app, client, room, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_SEARCH_FTS', False)
+    exact = post(client, 'I am 100% sure', room=room)
+    post(client, 'over 1000 users', room=room)
+    post(client, 'snake_case names', room=room)
+    post(client, 'snakecase names', room=room)
+    
+    assert [m['id'] for m in search(client, MEMBER, '0%', room=room)] == [exact]
+    assert [m['content'] for m in search(client, MEMBER, 'e_c', room=room)] == ['snake_case names']
@@ -0,0 +1,105 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import server
+
+pytest.importorskip('web3')
+
+BLOCK = {
+    'number': '0x10', 'timestamp': '0x65f25a80', 'transactions': ['0x' + 'ab' * 32, '0x' + 'cd' * 32],
+    'hash': '0x' + '12' * 32, 'parentHash': '0x' + '34' * 32, 'extraData': '0x', 'gasLimit': '0x1c9c380',
+    'gasUsed': '0x5208', 'miner': '0x' + '00' * 20, 'difficulty': '0x1', 'size': '0x220'
+}
+RESULTS = {'eth_chainId': '0x89', 'eth_gasPrice': '0x6fc23ac00', 'eth_getBlockByNumber': BLOCK}
+
+
+class FakeProvider(ThreadingHTTPServer):
+    """A JSON-RPC endpoint answering the calls the network sampler makes."""
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRPCHandler)
+        self.calls = Counter()
+        self.failing = False
+    
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+
+class FakeRPCHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.calls[request['method']] += 1
+        response = {'jsonrpc': '2.0', 'id': request['id']}
+        if self.server.failing:
+            response['error'] = {'code': -32000, 'message': 'upstream unavailable'}
+        else:
+            response['result'] = RESULTS[request['method']]
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def provider():
+    fake = FakeProvider()
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+    yield fake
+    fake.shutdown()
+    fake.server_close()
+
+
+@pytest.fixture
+def sampler(provider, monkeypatch):
+    sampler = server.NetworkSampler(server.connect_web3(provider.url))
+    monkeypatch.setattr(server, 'network_sampler', sampler)
+    return sampler
+
+
+def test_sampler_caches_the_chain_and_broadcasts_new_blocks(provider, sampler):
+    delay, update = sampler.step()
+    assert delay == server.NETWORK_SAMPLE_INTERVAL
+    assert update['connected'] is True
+    assert update['chainId'] == 137
+    assert update['latestBlock'] == 16
+    assert update['gasPrice'] == str(0x6fc23ac00)
+    assert update['blockTransactions'] == 2
+    
+    # Same block again: nothing to broadcast, and chain_id is not asked twice
+    assert sampler.step() == (server.NETWORK_SAMPLE_INTERVAL, None)
+    assert provider.calls == {'eth_chainId': 1, 'eth_getBlockByNumber': 2, 'eth_gasPrice': 2}
+
+
+def test_sampler_reports_outages_and_backs_off(client, provider, sampler):
+    sampler.step()
+    provider.failing = True
+    
+    delay, update = sampler.step()
+    assert delay == server.NETWORK_SAMPLE_INTERVAL * 2
+    assert update['connected'] is False and update['latestBlock'] == 16
+    status = client.get('/api/network-status').get_json()
+    assert status['connected'] is False and status['latestBlock'] == 16
+    
+    delays = [sampler.step() for _ in range(6)]
+    assert [update for _, update in delays] == [None] * 6
+    assert delays[-1][0] == server.NETWORK_MAX_BACKOFF
+    
+    provider.failing = False
+    delay, update = sampler.step()
+    assert delay == server.NETWORK_SAMPLE_INTERVAL
+    assert update['connected'] is True
+    assert client.get('/api/network-status').get_json()['connected'] is True
+
+
+def test_sampler_needs_an_endpoint(app):
+    assert app.config['POLYGON_RPC_URL'] == ''
+    assert server.connect_web3(app.config['POLYGON_RPC_URL']) is None
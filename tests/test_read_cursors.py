@@ -0,0 +1,31 @@
+import pytest
+
+pytestmark = pytest.mark.usefixtures('ingestor')
+
+READER = '0xreader0001'
+SENDER = '0xsender0001'
+
+
+def unread(client, room):
+    return client.get(f'/api/unread?walletAddress={READER}').get_json()['rooms'].get(room)
+
+
+def post(client, room, content):
+    response = client.post('/api/messages?durable=true', json={
+        'content': content, 'walletAddress': SENDER, 'room': room
+    })
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_repeat_delete_counts_once(client, room):
+    client.post('/api/messages?durable=true', json={'content': 'hi', 'walletAddress': READER, 'room': room})
+    assert client.post('/api/read-cursors', json={'walletAddress': READER, 'room': room}).status_code == 200
+
+    message_ids = [post(client, room, f'message {i}') for i in range(3)]
+    assert unread(client, room) == 3
+
+    for _ in range(3):
+        response = client.delete(f'/api/messages/{message_ids[0]}?walletAddress={SENDER}')
+        assert response.status_code == 200
+    assert unread(client, room) == 2
@@ -0,0 +1,44 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter, because the runtime patches the standard library
+PROBE = """
+import json, threading
+import serve  # patches the runtime, then creates the app
+import server
+from sqlalchemy import text
+
+with server.app.app_context():
+    connection = server.db.session.connection().connection.dbapi_connection
+    connection.create_function('native_thread', 0, threading.get_native_id)
+    print(json.dumps({
+        'connection': type(connection).__name__,
+        'caller': threading.get_native_id(),
+        'query': server.db.session.execute(text('SELECT native_thread()')).scalar(),
+        'rooms': server.db.session.execute(text('SELECT count(*) FROM chat_rooms')).scalar()
+    }))
+"""
+
+
+@pytest.mark.parametrize('mode', ['eventlet', 'gevent'])
+def test_serve_runs_db_calls_in_the_native_pool(mode, tmp_path):
+    if importlib.util.find_spec(mode) is None:
+        pytest.skip(f'{mode} is not installed')
+    env = dict(os.environ, ASYNC_MODE=mode, POLYGON_RPC_URL='',
+               DATABASE_URL=f"sqlite:///{tmp_path / 'runtime.db'}")
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    
+    assert probe['connection'] == 'BlockingProxy'
+    assert probe['query'] != probe['caller']
+    assert probe['rooms'] == 3
@@ -0,0 +1,98 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+
+def wallet():
+    return f'0xshared{os.urandom(4).hex()}'
+
+
+@pytest.fixture
+def shared(app, monkeypatch):
+    """Record what this process sends to the other server processes."""
+    sent = []
+    monkeypatch.setattr(server.socketio.server.manager, 'share', lambda name, change: sent.append((name, change)))
+    return sent
+
+
+@pytest.mark.usefixtures('ingestor')
+def test_blockers_sessions_are_skipped(app, client, room):
+    blocker, sender = wallet(), wallet()
+    blocker_socket = server.socketio.test_client(app)
+    other_socket = server.socketio.test_client(app)
+    blocker_socket.emit('join', {'type': 'public', 'roomId': room})
+    blocker_socket.emit('join', {'type': 'user', 'roomId': blocker})
+    other_socket.emit('join', {'type': 'public', 'roomId': room})
+    client.post('/api/users/block', json={'blockerId': blocker, 'blockedId': sender})
+    blocker_socket.get_received()
+    other_socket.get_received()
+
+    client.post('/api/messages?durable=true', json={'content': 'hidden', 'walletAddress': sender, 'room': room})
+    time.sleep(0.1)
+    assert [event['name'] for event in other_socket.get_received()] == ['new_message']
+    assert blocker_socket.get_received() == []
+    blocker_socket.disconnect()
+    other_socket.disconnect()
+
+
+def test_block_changes_are_shared(client, shared):
+    blocker, blocked = wallet(), wallet()
+    client.post('/api/users/block', json={'blockerId': blocker, 'blockedId': blocked})
+    client.post('/api/users/unblock', json={'blockerId': blocker, 'blockedId': blocked})
+    assert shared == [
+        ('blocks', {'blockerId': blocker, 'blockedId': blocked, 'blocked': True}),
+        ('blocks', {'blockerId': blocker, 'blockedId': blocked, 'blocked': False})
+    ]
+
+    # Applied the same way where they arrive
+    server.block_registry.apply(shared[0][1])
+    assert server.block_registry.blockers_of(blocked) == {blocker}
+    server.block_registry.apply(shared[1][1])
+    assert server.block_registry.blockers_of(blocked) == set()
+
+
+def test_shared_profile_and_heartbeats_keep_a_user_online(client, shared):
+    address = wallet()
+    client.post('/api/user/presence', json={'walletAddress': address, 'name': 'Sharer'})
+    [(name, change)] = shared
+    assert name == 'profiles' and change['profile']['displayName'] == 'Sharer'
+
+    # Another process learns of the user, last seen long enough ago to expire
+    tracker = server.PresenceTracker()
+    stale = dict(change, lastActive=(datetime.now() - timedelta(minutes=6)).isoformat())
+    tracker.apply(stale)
+    assert tracker.display_name(address) == 'Sharer'
+    # A heartbeat flushed by the first process arrives before the sweep
+    assert tracker.apply_heartbeats({address: datetime.now().isoformat()}) == []
+    assert address not in tracker.expire()
+    assert address in tracker.snapshot()[1]
+
+
+def test_heartbeats_for_unknown_users_load_their_profile(app, client, shared):
+    address = wallet()
+    client.post('/api/user/presence', json={'walletAddress': address, 'name': 'Late'})
+    with server.presence_tracker._lock:
+        server.presence_tracker._profiles.pop(address)
+
+    server.apply_shared_heartbeats({address: datetime.now().isoformat()})
+    assert server.presence_tracker.display_name(address) == 'Late'
+
+
+def test_typing_from_another_process_joins_the_frame(app, room, shared):
+    room_name = f'room_{room}'
+    typist, remote_typist = wallet(), wallet()
+    server.typing_aggregator.set_display_name(typist, 'Here')
+    assert server.typing_aggregator.update(room_name, typist, True)
+    server.typing_aggregator.apply({
+        'room': room_name, 'userId': remote_typist, 'displayName': 'There', 'isTyping': True
+    })
+    users = server.typing_aggregator.collect()[room_name]
+    assert sorted(user['displayName'] for user in users) == ['Here', 'There']
+    # Repeats inside the throttle window are not accepted, so not shared either
+    assert not server.typing_aggregator.update(room_name, typist, True)
+    server.typing_aggregator.update(room_name, typist, False)
+    server.typing_aggregator.update(room_name, remote_typist, False)
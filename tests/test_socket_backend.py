@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+
+import socketio
+from flask import Flask
+from flask_socketio import SocketIO, join_room
+from werkzeug.serving import make_server
+
+import fast_json
+from socket_backend import LocalManager, cluster_manager, socketio_options, start_listening
+
+
+def start_server(channel):
+    """Serve a SocketIO app on a free port, fanned out over the local broker."""
+    app = Flask(f'worker-{os.urandom(2).hex()}')
+    sio = SocketIO(app, async_mode='threading', json=fast_json,
+                   client_manager=cluster_manager(LocalManager)(channel))
+
+    @sio.on('join')
+    def join(data):
+        join_room(data['room'])
+
+    http = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    return sio, http
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_local_queue_fans_out_between_servers():
+    channel = f'test-{os.urandom(4).hex()}'
+    first, first_http = start_server(channel)
+    second, second_http = start_server(channel)
+    client = socketio.Client()
+    received = []
+    client.on('new_message', received.append)
+    try:
+        client.connect(f'http://127.0.0.1:{second_http.server_port}', transports=['polling'])
+        client.call('join', {'room': 'room_1'})
+
+        # Emitted on the server the client is not connected to, already encoded
+        first.emit('new_message', fast_json.EncodedJSON({'content': 'across'}), to='room_1')
+        first.emit('new_message', {'content': 'elsewhere'}, to='room_2')
+        assert wait_for(lambda: received)
+        time.sleep(0.2)
+        assert received == [{'content': 'across'}]
+    finally:
+        client.disconnect()
+        for sio, http in ((first, first_http), (second, second_http)):
+            http.shutdown()
+            sio.server.manager.close()
+
+
+def connect(http, *rooms):
+    client = socketio.Client()
+    received = []
+    client.on('new_message', received.append)
+    client.connect(f'http://127.0.0.1:{http.server_port}', transports=['polling'])
+    for room in rooms:
+        client.call('join', {'room': room})
+    return client, received
+
+
+def test_skipped_rooms_are_resolved_by_each_server():
+    channel = f'test-{os.urandom(4).hex()}'
+    first, first_http = start_server(channel)
+    second, second_http = start_server(channel)
+    clients = []
+    try:
+        blocker, blocker_received = connect(second_http, 'room_1', 'user_blocker')
+        local_blocker, local_blocker_received = connect(first_http, 'room_1', 'user_blocker')
+        other, other_received = connect(second_http, 'room_1')
+        clients = [blocker, local_blocker, other]
+
+        # Skips every session in user_blocker, on both servers
+        first.emit('new_message', {'content': 'hidden'}, to='room_1', skip_sid=['user_blocker'])
+        assert wait_for(lambda: other_received)
+        time.sleep(0.2)
+        assert other_received == [{'content': 'hidden'}]
+        assert blocker_received == [] and local_blocker_received == []
+    finally:
+        for client in clients:
+            client.disconnect()
+        for sio, http in ((first, first_http), (second, second_http)):
+            http.shutdown()
+            sio.server.manager.close()
+
+
+def test_shared_state_reaches_the_other_servers():
+    channel = f'test-{os.urandom(4).hex()}'
+    first, first_http = start_server(channel)
+    second, second_http = start_server(channel)
+    changes = {'first': [], 'second': []}
+    try:
+        first.server.manager.on_state('blocks', changes['first'].append)
+        second.server.manager.on_state('blocks', changes['second'].append)
+        # Listening starts without waiting for a client to connect
+        start_listening(second.server)
+
+        first.server.manager.share('blocks', {'blockerId': 'a', 'blockedId': 'b', 'blocked': True})
+        assert wait_for(lambda: changes['second'])
+        assert changes == {'first': [], 'second': [{'blockerId': 'a', 'blockedId': 'b', 'blocked': True}]}
+    finally:
+        for sio, http in ((first, first_http), (second, second_http)):
+            http.shutdown()
+            sio.server.manager.close()
+
+
+def test_without_a_queue_skipped_rooms_still_apply():
+    manager = socketio_options()['client_manager']
+    assert not isinstance(manager, socketio.PubSubManager)
+    app = Flask('single')
+    sio = SocketIO(app, async_mode='threading', client_manager=manager)
+
+    @sio.on('join')
+    def join(data):
+        join_room(data['room'])
+
+    blocker = sio.test_client(app)
+    other = sio.test_client(app)
+    blocker.emit('join', {'room': 'room_1'})
+    blocker.emit('join', {'room': 'user_blocker'})
+    other.emit('join', {'room': 'room_1'})
+    # Sharing is a no-op without other processes
+    manager.share('blocks', {'blockerId': 'a', 'blockedId': 'b', 'blocked': True})
+
+    sio.emit('new_message', {'content': 'hidden'}, to='room_1', skip_sid='user_blocker')
+    assert [event['args'] for event in other.get_received()] == [[{'content': 'hidden'}]]
+    assert blocker.get_received() == []
+
+
+def test_local_queue_url_selects_local_manager(monkeypatch):
+    monkeypatch.setenv('SOCKETIO_MESSAGE_QUEUE', 'local://')
+    monkeypatch.setenv('SOCKETIO_CHANNEL', 'test-options')
+    manager = socketio_options()['client_manager']
+    try:
+        assert isinstance(manager, LocalManager)
+        assert manager.channel == 'test-options'
+    finally:
+        manager.close()
@@ -0,0 +1,102 @@
+import hashlib
+import io
+import os
+
+import server
+
+
+def upload_avatar(client, wallet_address, content):
+    response = client.post('/api/profile/avatar', data={
+        'walletAddress': wallet_address,
+        'avatar': (io.BytesIO(content), 'avatar.png'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['avatar']
+
+
+def ref_count(app, url):
+    with app.app_context():
+        stored = server.db.session.get(server.StoredFile, server.stored_upload_name(url))
+        return stored.ref_count if stored else None
+
+
+def upload_path(app, url):
+    return os.path.join(app.config['UPLOAD_FOLDER'], server.stored_upload_name(url))
+
+
+def test_replaced_avatars_release_their_file(app, client):
+    content = os.urandom(64)
+    first = upload_avatar(client, '0xavatar0001', content)
+    assert upload_avatar(client, '0xavatar0002', content) == first
+    assert ref_count(app, first) == 2
+
+    upload_avatar(client, '0xavatar0001', os.urandom(64))
+    assert ref_count(app, first) == 1
+    assert os.path.exists(upload_path(app, first))
+
+    upload_avatar(client, '0xavatar0002', os.urandom(64))
+    assert ref_count(app, first) is None
+    assert not os.path.exists(upload_path(app, first))
+
+
+def test_profile_avatar_holds_a_reference(app, client):
+    shared = upload_avatar(client, '0xavatar0003', os.urandom(64))
+    client.post('/api/profile', json={'walletAddress': '0xavatar0004', 'avatar': shared})
+    assert ref_count(app, shared) == 2
+
+    # Pointing a profile elsewhere cannot release another user's reference
+    client.post('/api/profile', json={'walletAddress': '0xavatar0004', 'avatar': 'https://example.com/a.png'})
+    client.post('/api/profile', json={'walletAddress': '0xavatar0004', 'avatar': 'https://example.com/b.png'})
+    assert ref_count(app, shared) == 1
+    assert os.path.exists(upload_path(app, shared))
+
+
+def fail_next_commit(monkeypatch):
+    """Make the next commit that saves a profile change fail."""
+    commit = server.db.session.commit
+    failed = []
+    
+    def commit_or_fail():
+        session = server.db.session
+        saves_profile = any(isinstance(obj, server.User) for obj in list(session.new) + list(session.dirty))
+        if saves_profile and not failed:
+            failed.append(True)
+            raise RuntimeError('disk full')
+        return commit()
+    monkeypatch.setattr(server.db.session, 'commit', commit_or_fail)
+
+
+def post_avatar(client, wallet_address, content):
+    return client.post('/api/profile/avatar', data={
+        'walletAddress': wallet_address,
+        'avatar': (io.BytesIO(content), 'avatar.png'),
+    }, content_type='multipart/form-data')
+
+
+def test_failed_avatar_change_leaves_no_reference(app, client, monkeypatch):
+    content = os.urandom(64)
+    fail_next_commit(monkeypatch)
+    assert post_avatar(client, '0xavatar0005', content).status_code == 500
+    
+    # Same file again, now that it has a row: the failed change gives it back
+    url = upload_avatar(client, '0xavatar0006', content)
+    assert ref_count(app, url) == 1
+    fail_next_commit(monkeypatch)
+    assert post_avatar(client, '0xavatar0005', content).status_code == 500
+    assert ref_count(app, url) == 1
+    assert os.path.exists(upload_path(app, url))
+    
+    # The only user moves on, so nothing is left behind
+    upload_avatar(client, '0xavatar0006', os.urandom(64))
+    assert ref_count(app, url) is None
+    assert not os.path.exists(upload_path(app, url))
+
+
+def test_failed_first_upload_removes_its_file(app, client, monkeypatch):
+    content = os.urandom(64)
+    url = '/static/uploads/' + hashlib.sha256(content).hexdigest() + '.png'
+    fail_next_commit(monkeypatch)
+    assert post_avatar(client, '0xavatar0007', content).status_code == 500
+    assert ref_count(app, url) is None
+    assert not os.path.exists(upload_path(app, url))
+    assert not [name for name in os.listdir(app.config['UPLOAD_FOLDER']) if name.endswith('.deleting')]
@@ -0,0 +1,48 @@
+from sqlalchemy import text
+
+import server
+
+FIRST = '0x5ea4c40000000000000000000000000000000001'
+SECOND = '0x5ea4c40000000000000000000000000000000002'
+
+
+def set_name(client, wallet_address, display_name):
+    response = client.post('/api/profile', json={'walletAddress': wallet_address, 'displayName': display_name})
+    assert response.status_code == 200
+
+
+def search(client, query):
+    response = client.get('/api/users/search', query_string={'query': query})
+    assert response.status_code == 200
+    return [user['walletAddress'] for user in response.get_json()]
+
+
+def test_search_survives_renumbered_rowids(app, client):
+    set_name(client, FIRST, 'Quokka Keeper')
+    set_name(client, SECOND, 'Wombat Walker')
+    
+    # What VACUUM may do to a table without an INTEGER PRIMARY KEY
+    with app.app_context():
+        rowids = dict(server.db.session.execute(text(
+            "SELECT wallet_address, rowid FROM users WHERE wallet_address IN (:a, :b)"
+        ), {'a': FIRST, 'b': SECOND}).all())
+        swaps = [(FIRST, -1), (SECOND, rowids[FIRST]), (FIRST, rowids[SECOND])]
+        for wallet_address, rowid in swaps:
+            server.db.session.execute(text("UPDATE users SET rowid = :rowid WHERE wallet_address = :wallet"),
+                                      {'rowid': rowid, 'wallet': wallet_address})
+        server.db.session.commit()
+    
+    assert search(client, 'quokka') == [FIRST]
+    assert search(client, 'wombat') == [SECOND]
+    
+    # Renames replace the indexed name
+    set_name(client, FIRST, 'Platypus Keeper')
+    assert search(client, 'quokka') == []
+    assert search(client, 'platypus') == [FIRST]
+
+
+def test_like_search_escapes_wildcards(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'USER_SEARCH_FTS', False)
+    set_name(client, '0xlike00001', 'Half_Moon')
+    set_name(client, '0xlike00002', 'HalfXMoon')
+    assert search(client, 'lf_Mo') == ['0xlike00001']